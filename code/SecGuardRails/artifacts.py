@@ -0,0 +1,166 @@
+"""Reads and writes CodePipeline artifacts in S3 without temporary files
+
+Artifacts are zip files. A zip is read from its end: the end of central
+directory record and the central directory list every member and where its
+data starts. S3RangeFile gives zipfile a seekable file backed by ranged GETs,
+so extracting one member only fetches the tail of the zip and the byte range
+of that member. The tail is fetched once when the file is opened and, for
+small artifacts, already holds the whole object.
+
+Output artifacts are built in memory and stored with a single PUT.
+"""
+
+from __future__ import print_function
+import io
+import zipfile
+
+# Bytes fetched from the end of the object when it is opened. This covers the
+# end of central directory record with the longest possible comment plus a
+# central directory of several hundred members.
+TAIL_SIZE = 256 * 1024
+
+# Bytes fetched per ranged GET when reading past the tail
+BLOCK_SIZE = 256 * 1024
+
+
+class S3RangeFile(io.RawIOBase):
+    """Read-only, seekable file over an S3 object using ranged GETs
+
+    Args:
+        s3: An S3 client
+        bucket: The bucket of the object
+        key: The key of the object
+        tailSize: Bytes to fetch from the end of the object when opened
+
+    """
+
+    def __init__(self, s3, bucket, key, tailSize=TAIL_SIZE):
+        super(S3RangeFile, self).__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.position = 0
+        self.requests = 0
+        response = self.get_range('bytes=-{0}'.format(tailSize))
+        self.tail = response['Body'].read()
+        if 'ContentRange' in response:
+            self.size = int(response['ContentRange'].rsplit('/', 1)[1])
+        else:
+            self.size = len(self.tail)
+        self.tailStart = self.size - len(self.tail)
+
+    def get_range(self, byteRange):
+        self.requests += 1
+        return self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=byteRange)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError('Invalid whence {0}'.format(whence))
+        if position < 0:
+            raise ValueError('Negative seek position {0}'.format(position))
+        self.position = position
+        return position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        if self.position >= self.tailStart:
+            data = self.tail[self.position - self.tailStart:end - self.tailStart]
+        else:
+            # Stop at the tail, which is already in memory
+            end = min(end, self.tailStart)
+            data = self.get_range('bytes={0}-{1}'.format(self.position, end - 1))['Body'].read()
+        count = len(data)
+        buffer[:count] = data
+        self.position += count
+        return count
+
+
+def read_member(s3, bucket, key, fileInZip, debug=False):
+    """Extracts one member of a zip stored in S3
+
+    Args:
+        s3: An S3 client
+        bucket: The bucket of the zip
+        key: The key of the zip
+        fileInZip: The path of the member within the zip
+        debug: Whether to print the list of members
+
+    Returns:
+        The content of the member as bytes
+
+    Raises:
+        KeyError: The member is not in the zip
+
+    """
+    raw = S3RangeFile(s3, bucket, key)
+    with zipfile.ZipFile(io.BufferedReader(raw, buffer_size=BLOCK_SIZE), 'r') as zip:
+        if debug:
+            zip.printdir()
+        data = zip.read(fileInZip)
+    print("Extracted {0} ({1} bytes) from a {2} byte artifact with {3} requests".format(
+        fileInZip, len(data), raw.size, raw.requests))
+    return data
+
+
+def build_zip(fileInZip, data, compressLevel=6):
+    """Builds a zip holding a single file in memory
+
+    Args:
+        fileInZip: The path of the file within the zip
+        data: The content of the file
+        compressLevel: The deflate level from 1 to 9, or 0 to store the file
+            uncompressed
+
+    Returns:
+        The zip as bytes
+
+    """
+    buffer = io.BytesIO()
+    if compressLevel == 0:
+        zip = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED)
+    else:
+        zip = zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=compressLevel)
+    with zip:
+        zip.writestr(fileInZip, data)
+    return buffer.getvalue()
+
+
+def put_zip(s3, bucket, key, fileInZip, data, compressLevel=6, sse=None, kmsKeyId=None):
+    """Stores a single file zip in S3
+
+    Args:
+        s3: An S3 client
+        bucket: The bucket to store the zip in
+        key: The key of the zip
+        fileInZip: The path of the file within the zip
+        data: The content of the file
+        compressLevel: The deflate level, see build_zip
+        sse: The server side encryption, 'AES256' or 'aws:kms', or None
+        kmsKeyId: The KMS key used with 'aws:kms', or None for the default
+
+    """
+    extra = dict()
+    if sse:
+        extra['ServerSideEncryption'] = sse
+        if sse == 'aws:kms' and kmsKeyId:
+            extra['SSEKMSKeyId'] = kmsKeyId
+    body = build_zip(fileInZip, data, compressLevel)
+    print("Storing s3://" + bucket + "/" + key)
+    s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/zip', **extra)
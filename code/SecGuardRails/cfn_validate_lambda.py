@@ -1,21 +1,54 @@
 from __future__ import print_function
-from boto3.session import Session
 
+import hashlib
 import json
-import urllib
-import boto3
-import zipfile
-import tempfile
-import botocore
+import os
 import traceback
-import re
-import zipfile
 import time
 
+import botocore
+
+from . import artifacts
+from . import clients
+from . import rule_engine
+
 print('Loading function')
 
-cf = boto3.client('cloudformation')
-code_pipeline = boto3.client('codepipeline')
+
+# Rules are kept at module scope so warm invocations of the same container can
+# skip reloading them from DynamoDB. The cache is refreshed every
+# RULE_CACHE_TTL seconds, or earlier when the version item stored under
+# RULE_VERSION_KEY in the rules table changes.
+RULE_CACHE_TTL = int(os.environ.get('RULE_CACHE_TTL', '300'))
+RULE_VERSION_KEY = os.environ.get('RULE_VERSION_KEY', 'RulesVersion')
+# Skip regex rules whose required literals are missing from a resource
+RULE_PREFILTER = os.environ.get('RULE_PREFILTER', 'true').lower() == 'true'
+# Seconds a regex rule prone to backtracking may spend on a single resource
+RULE_TIME_BUDGET = float(os.environ.get('RULE_TIME_BUDGET', '1'))
+# Print the content of the artifacts read
+DEBUG = os.environ.get('DEBUG', 'false').lower() == 'true'
+# Deflate level of the output artifact, 0 stores the template uncompressed
+OUTPUT_COMPRESSION_LEVEL = int(os.environ.get('OUTPUT_COMPRESSION_LEVEL', '6'))
+# Server side encryption of the output artifact: AES256, aws:kms or none
+OUTPUT_SSE = os.environ.get('OUTPUT_SSE', 'AES256')
+OUTPUT_SSE_KMS_KEY_ID = os.environ.get('OUTPUT_SSE_KMS_KEY_ID')
+
+# Verdicts of templates already scored are kept in this table, keyed on the
+# SHA-256 of the template and the fingerprint of the rules, for VERDICT_TTL
+# seconds. An empty name disables the cache.
+VERDICT_TABLE = os.environ.get('VERDICT_TABLE', '')
+VERDICT_TTL = int(os.environ.get('VERDICT_TTL', str(7 * 24 * 3600)))
+# Verdicts larger than this are not cached, below the 400 KB DynamoDB item limit
+MAX_VERDICT_BYTES = 350 * 1024
+METRIC_NAMESPACE = 'SecGuardRails'
+rule_cache = {'rules': None, 'table': None, 'version': None, 'loaded': 0.0}
+
+# Name of the rules table. The "rulesTable" user parameter takes precedence,
+# and when neither is set the table is discovered once per container.
+RULES_TABLE = os.environ.get('RULES_TABLE', '')
+# Substring of the name of a discovered rules table
+RULES_TABLE_MARKER = 'AWS-devsecops'
+rule_table = {'name': None}
 
 def find_artifact(artifacts, name):
     """Finds the artifact 'name' among the 'artifacts'
@@ -39,11 +72,12 @@ def find_artifact(artifacts, name):
 def get_template(s3, artifact, file_in_zip):
     """Gets the template artifact
 
-    Downloads the artifact from the S3 artifact store to a temporary file
-    then extracts the zip and returns the file containing the CloudFormation
-    template.
+    Reads the template straight out of the artifact zip in the S3 artifact
+    store. Only the zip directory and the template itself are fetched, using
+    ranged GETs, so other files bundled in the artifact are never downloaded.
 
     Args:
+        s3: An S3 client with access to the artifact store
         artifact: The artifact to download
         file_in_zip: The path to the file within the zip containing the template
 
@@ -54,16 +88,11 @@ def get_template(s3, artifact, file_in_zip):
         Exception: Any exception thrown while downloading the artifact or unzipping it
 
     """
-    tmp_file = tempfile.NamedTemporaryFile()
     bucket = artifact['location']['s3Location']['bucketName']
     key = artifact['location']['s3Location']['objectKey']
 
-    with tempfile.NamedTemporaryFile() as tmp_file:
-        print("Retrieving s3://" + bucket + "/" + key)
-        s3.download_file(bucket, key, tmp_file.name)
-        with zipfile.ZipFile(tmp_file.name, 'r') as zip:
-            zip.printdir()
-            return zip.read(file_in_zip)
+    print("Retrieving s3://" + bucket + "/" + key)
+    return artifacts.read_member(s3, bucket, key, file_in_zip, debug=DEBUG)
 
 
 def put_job_success(job, message):
@@ -79,7 +108,7 @@ def put_job_success(job, message):
     """
     print('Putting job success')
     print(message)
-    code_pipeline.put_job_success_result(jobId=job)
+    clients.get_client('codepipeline').put_job_success_result(jobId=job)
 
 def put_job_failure(job, message):
     """Notify CodePipeline of a failed job
@@ -94,7 +123,7 @@ def put_job_failure(job, message):
     """
     print('Putting job failure')
     print(message)
-    code_pipeline.put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
+    clients.get_client('codepipeline').put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
 
 def continue_job_later(job, message):
     """Notify CodePipeline of a continuing job
@@ -118,7 +147,7 @@ def continue_job_later(job, message):
 
     print('Putting job continuation')
     print(message)
-    code_pipeline.put_job_success_result(jobId=job, continuationToken=continuation_token)
+    clients.get_client('codepipeline').put_job_success_result(jobId=job, continuationToken=continuation_token)
 
 def get_user_params(job_data):
     print(job_data)
@@ -128,7 +157,9 @@ def get_user_params(job_data):
         job_data: The job data structure containing the UserParameters string which should be a valid JSON structure
 
     Returns:
-        The JSON parameters decoded as a dictionary.
+        The JSON parameters decoded as a dictionary. Besides the required
+        input, file and output properties, the optional rulesTable names the
+        rules table.
 
     Raises:
         Exception: The JSON can't be decoded or a property is missing.
@@ -163,10 +194,11 @@ def get_user_params(job_data):
     return decoded_parameters
 
 def setup_s3_client(job_data):
-    """Creates an S3 client
+    """Returns the S3 client of the artifact bucket
 
     Uses the credentials passed in the event by CodePipeline. These
-    credentials can be used to access the artifact bucket.
+    credentials can be used to access the artifact bucket. The client is
+    reused by the next jobs passed the same credentials.
 
     Args:
         job_data: The job data structure
@@ -175,213 +207,455 @@ def setup_s3_client(job_data):
         An S3 client with the appropriate credentials
 
     """
-    key_id = job_data['artifactCredentials']['accessKeyId']
-    key_secret = job_data['artifactCredentials']['secretAccessKey']
-    session_token = job_data['artifactCredentials']['sessionToken']
-
-    session = Session(
-        aws_access_key_id=key_id,
-        aws_secret_access_key=key_secret,
-        aws_session_token=session_token)
-    return session.client('s3', config=botocore.client.Config(signature_version='s3v4'))
-
-def get_rules():
-    # Find table
-    client = boto3.client('dynamodb')
-    resource = boto3.resource('dynamodb')
-    response = client.list_tables()
-    logTable = ""
-    for i in range(len(response['TableNames'])):
-        if "AWS-devsecops" in response['TableNames'][i]:
-            logTable = response['TableNames'][i]
+    return clients.get_client('s3', credentials=job_data['artifactCredentials'])
 
-    # Verify that rules are created and if not, create them
-    response = client.scan(
+def find_rule_table(client):
+    """Finds the DynamoDB table holding the validation rules
+
+    Only used when no table name is configured. Every page of list_tables is
+    read; a table named exactly RULES_TABLE_MARKER wins, otherwise the first
+    table containing it, other than the verdict table.
+
+    Args:
+        client: A DynamoDB client
+
+    Returns:
+        The name of the rules table
+
+    Raises:
+        Exception: No table matches
+
+    """
+    candidates = []
+    paginator = client.get_paginator('list_tables')
+    for page in paginator.paginate():
+        for tableName in page['TableNames']:
+            if tableName == RULES_TABLE_MARKER:
+                return tableName
+            if RULES_TABLE_MARKER in tableName and tableName != VERDICT_TABLE:
+                candidates.append(tableName)
+    if not candidates:
+        raise Exception('No rules table found, set RULES_TABLE or the "rulesTable" user parameter')
+    return sorted(candidates)[0]
+
+
+def resolve_rule_table(client, tableName=None):
+    """Returns the name of the rules table
+
+    Args:
+        client: A DynamoDB client
+        tableName: The table named in the user parameters, or None
+
+    Returns:
+        The given name, else RULES_TABLE, else the table found by
+        find_rule_table, which is remembered for the next invocations
+
+    """
+    if tableName:
+        return tableName
+    if RULES_TABLE:
+        return RULES_TABLE
+    if rule_table['name'] is None:
+        rule_table['name'] = find_rule_table(client)
+        print("Discovered rules table " + rule_table['name'])
+    return rule_table['name']
+
+
+def get_rules_version(client, logTable):
+    """Reads the version stamp of the rule set
+
+    Whoever edits the rules bumps the 'version' attribute of the item stored
+    under RULE_VERSION_KEY so warm containers drop their cached rules early.
+
+    Args:
+        client: A DynamoDB client
+        logTable: The name of the rules table
+
+    Returns:
+        The version attribute of the version item, or None if there is none
+
+    """
+    response = client.get_item(
         TableName=logTable,
-        AttributesToGet=[
-            'rule',
-        ]
+        Key={
+            'rule': {'S': RULE_VERSION_KEY}
+        },
+        ProjectionExpression='version',
+        ConsistentRead=True
     )
-    if len(response['Items']) == 0:
-        add_rules(logTable)
-        time.sleep(45)
-
-    # Get all rules from DDB.
-    # Rules have rule, ruledata, type and weight
-    rules = dict()
-    sgRules = []
-    ec2Rules = []
-    volRules = []
-
-    for n in range(len(response['Items'])):
-        rule = client.get_item(
-            TableName=logTable,
-            Key={
-                'rule': {'S':response['Items'][n]['rule']['S']}
-            },
-            ConsistentRead=True
-        )['Item']
-        if rule['category']['S'] == "SecurityGroup":
-            sgRules.append(rule)
-        elif rule['category']['S'] == "EC2Instance":
-            ec2Rules.append(rule)
-        elif rule['category']['S'] == "Volume":
-            volRules.append(rule)
-
-    rules['sgRules'] = sgRules
-    rules['ec2Rules'] = ec2Rules
-    rules['volRules'] = volRules
+    return response.get('Item', {}).get('version')
+
+
+def get_rules(tableName=None):
+    """Gets the validation rules, reusing the cached copy when still valid
+
+    Args:
+        tableName: The rules table named in the user parameters, or None
+
+    Returns:
+        The active rules as a rule_engine.RuleSet
+
+    """
+    client = clients.get_client('dynamodb')
+    logTable = resolve_rule_table(client, tableName)
+    version = get_rules_version(client, logTable)
+
+    age = time.monotonic() - rule_cache['loaded']
+    if (rule_cache['rules'] is not None and rule_cache['table'] == logTable and rule_cache['version'] == version
+            and age < RULE_CACHE_TTL):
+        print("Using cached rules, version " + str(version))
+        return rule_cache['rules']
+
+    rules = load_rules(client, logTable)
+    rule_cache['rules'] = rules
+    rule_cache['table'] = logTable
+    rule_cache['version'] = version
+    rule_cache['loaded'] = time.monotonic()
     return rules
 
 
-def add_rules(logTable):
-    client = boto3.client('dynamodb')
-    client.put_item(
-        TableName=logTable,
-        Item={
-            'rule' : {'S': "IngressOpenToWorld"},
-            'category' : {'S': "SecurityGroup"},
-            'ruletype' : {'S': "regex"},
-            'ruledata' : {'S': "^.*Ingress.*((0\.){3}0\/0)"},
-            'riskvalue' : {'N': "100"},
-            'active' : {'S': "Y"}
-        }
-    )
-    client.put_item(
-        TableName=logTable,
-        Item={
-            'rule' : {'S': "SSHOpenToWorld"},
-            'category' : {'S': "SecurityGroup"},
-            'ruletype' : {'S': "regex"},
-            'ruledata' : {'S': "^.*Ingress.*(([fF]rom[pP]ort|[tT]o[pP]ort).\s*:\s*u?.(22).*[cC]idr[iI]p.\s*:\s*u?.((0\.){3}0\/0)|[cC]idr[iI]p.\s*:\s*u?.((0\.){3}0\/0).*([fF]rom[pP]ort|[tT]o[pP]ort).\s*:\s*u?.(22))"},
-            'riskvalue' : {'N': "100"},
-            'active' : {'S': "Y"}
-        }
-    )
-    client.put_item(
-        TableName=logTable,
-        Item={
-            'rule' : {'S': "AllowHttp"},
-            'category' : {'S': "SecurityGroup"},
-            'ruletype' : {'S': "regex"},
-            'ruledata' : {'S': "^.*Ingress.*[fF]rom[pP]ort.\s*:\s*u?.(80)"},
-            'riskvalue' : {'N': "3"},
-            'active' : {'S': "N"}
-        }
-    )
-    client.put_item(
-        TableName=logTable,
-        Item={
-            'rule' : {'S': "ForbiddenAMIs"},
-            'category' : {'S': "EC2Instance"},
-            'ruletype' : {'S': "regex"},
-            'ruledata' : {'S': "^.*ImageId.\s*:\s*u?.(ami-7a11e211|ami-08111162|ami-f6035893)"},
-            'riskvalue' : {'N': "10"},
-            'active' : {'S': "N"}
-        }
-    )
-    client.put_item(
-        TableName=logTable,
-        Item={
-            'rule' : {'S': "VolumesNotEncrypted"},
-            'category' : {'S': "Volume"},
-            'ruletype' : {'S': "regex"},
-            'ruledata' : {'S': "^.*Encrypted.?\s*:\s*u?.?false"},
-            'riskvalue' : {'N': "90"},
-            'active' : {'S': "Y"}
-        }
-    )
+def scan_rules(client, logTable):
+    """Reads every item of the rules table
+
+    The whole table is read with a paginated scan so each page of up to 1 MB
+    of rules costs a single round trip and no rule is lost past the first
+    page.
+
+    Args:
+        client: A DynamoDB client
+        logTable: The name of the rules table
+
+    Returns:
+        The list of items
+
+    """
+    items = []
+    paginator = client.get_paginator('scan')
+    for page in paginator.paginate(TableName=logTable, ConsistentRead=True):
+        items.extend(page['Items'])
+    return items
+
+
+def load_rules(client, logTable):
+    """Loads all rules from DynamoDB, seeding an empty table
+
+    Args:
+        client: A DynamoDB client
+        logTable: The name of the rules table
+
+    Returns:
+        The rule_engine.RuleSet
+
+    """
+    # Rules have rule, category, ruletype, ruledata, riskvalue and active
+    items = [item for item in scan_rules(client, logTable) if item['rule']['S'] != RULE_VERSION_KEY]
+
+    # Verify that rules are created and if not, create them
+    if len(items) == 0:
+        items = add_rules(client, logTable)
+    return rule_engine.RuleSet(items, prefilter=RULE_PREFILTER, budget=RULE_TIME_BUDGET)
+
+
+# Rules seeded into an empty rules table, in the DynamoDB item format
+DEFAULT_RULES = [
+    {
+        'rule' : {'S': "IngressOpenToWorld"},
+        'category' : {'S': "SecurityGroup"},
+        'ruletype' : {'S': "regex"},
+        'ruledata' : {'S': r"^.*Ingress.*((0\.){3}0\/0)"},
+        'riskvalue' : {'N': "100"},
+        'active' : {'S': "Y"}
+    },
+    {
+        'rule' : {'S': "SSHOpenToWorld"},
+        'category' : {'S': "SecurityGroup"},
+        'ruletype' : {'S': "regex"},
+        'ruledata' : {'S': r"^.*Ingress.*(([fF]rom[pP]ort|[tT]o[pP]ort).\s*:\s*u?.(22).*[cC]idr[iI]p.\s*:\s*u?.((0\.){3}0\/0)|[cC]idr[iI]p.\s*:\s*u?.((0\.){3}0\/0).*([fF]rom[pP]ort|[tT]o[pP]ort).\s*:\s*u?.(22))"},
+        'riskvalue' : {'N': "100"},
+        'active' : {'S': "Y"}
+    },
+    {
+        'rule' : {'S': "AllowHttp"},
+        'category' : {'S': "SecurityGroup"},
+        'ruletype' : {'S': "regex"},
+        'ruledata' : {'S': r"^.*Ingress.*[fF]rom[pP]ort.\s*:\s*u?.(80)"},
+        'riskvalue' : {'N': "3"},
+        'active' : {'S': "N"}
+    },
+    {
+        'rule' : {'S': "ForbiddenAMIs"},
+        'category' : {'S': "EC2Instance"},
+        'ruletype' : {'S': "regex"},
+        'ruledata' : {'S': r"^.*ImageId.\s*:\s*u?.(ami-7a11e211|ami-08111162|ami-f6035893)"},
+        'riskvalue' : {'N': "10"},
+        'active' : {'S': "N"}
+    },
+    {
+        'rule' : {'S': "VolumesNotEncrypted"},
+        'category' : {'S': "Volume"},
+        'ruletype' : {'S': "regex"},
+        'ruledata' : {'S': r"^.*Encrypted.?\s*:\s*u?.?false"},
+        'riskvalue' : {'N': "90"},
+        'active' : {'S': "Y"}
+    }
+]
+
+
+def add_rules(client, logTable):
+    """Seeds an empty rules table with DEFAULT_RULES
+
+    The rules are written in a single transaction in which each rule is only
+    put if no rule of that name exists yet, so a table seeded at the same
+    time by another invocation, or edited since, is left as it is.
+
+    Args:
+        client: A DynamoDB client
+        logTable: The name of the rules table
+
+    When the transaction is cancelled because the rules exist, the table is
+    read again. When it is cancelled for any other reason, such as a
+    conflict with another invocation seeding the table at the same time,
+    or the table still reads empty, DEFAULT_RULES are returned, so the
+    template is never scored against an empty rule set.
+
+    Returns:
+        The rule items: the content of the table when it was seeded by
+        another invocation, DEFAULT_RULES otherwise
+
+    Raises:
+        Exception: Any exception thrown by .transact_write_items() besides
+            the cancellation of the transaction by one of its conditions
+
+    """
+    print("Seeding rules table " + logTable)
+    try:
+        client.transact_write_items(TransactItems=[{'Put': {
+            'TableName': logTable,
+            'Item': item,
+            'ConditionExpression': 'attribute_not_exists(#rule)',
+            'ExpressionAttributeNames': {'#rule': 'rule'}
+        }} for item in DEFAULT_RULES])
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+        if 'ConditionalCheckFailed' in reasons and all(
+                code in ('None', 'ConditionalCheckFailed') for code in reasons):
+            items = [item for item in scan_rules(client, logTable) if item['rule']['S'] != RULE_VERSION_KEY]
+            if items:
+                print("Rules table already seeded, using its rules")
+                return items
+        print("Seeding cancelled ({0}), using the default rules".format(', '.join(map(str, reasons))))
+    return DEFAULT_RULES
 
 
 def evaluate_template(rules, template):
-    # Validate rules and increase risk value
-    risk = 0
-    # Extract Security Group Resources
-    sgResources = []
-    ec2Resources = []
-    volumeResources = []
-    failedRules = []
+    """Parses a template and scores it against the rules, see score_template
+
+    Args:
+        rules: The rule_engine.RuleSet to apply
+        template: The CloudFormation template as a string
+
+    Returns:
+        A tuple of the total risk value and the list of rule_engine.Finding
+        objects
+
+    """
     jsonTemplate = json.loads(template)
     print(json.dumps(jsonTemplate, sort_keys=True, indent=4, separators=(',', ': ')))
     print(rules)
-    for key in jsonTemplate['Resources'].keys():
-        if "EC2::SecurityGroup" in jsonTemplate['Resources'][key]['Type']:
-            sgResources.append(jsonTemplate['Resources'][key])
-        elif "EC2::Instance" in jsonTemplate['Resources'][key]['Type']:
-            ec2Resources.append(jsonTemplate['Resources'][key])
-        elif "EC2::Volume" in jsonTemplate['Resources'][key]['Type']:
-            volumeResources.append(jsonTemplate['Resources'][key])
-
-    for n in range(len(sgResources)):
-        for m in range(len(rules['sgRules'])):
-            if rules['sgRules'][m]['active']['S'] == "Y":
-                if re.match(rules['sgRules'][m]['ruledata']['S'], str(sgResources[n])):
-                    risk = risk + int(rules['sgRules'][m]['riskvalue']['N'])
-                    failedRules.append(str(rules['sgRules'][m]['rule']['S']))
-                    print("Matched rule: " + str(rules['sgRules'][m]['rule']['S']))
-                    print("Resource: " + str(sgResources[n]))
-                    print("Riskvalue: " + rules['sgRules'][m]['riskvalue']['N'])
-                    print("")
-
-    for n in range(len(ec2Resources)):
-        for m in range(len(rules['ec2Rules'])):
-            if rules['ec2Rules'][m]['active']['S'] == "Y":
-                if re.match(rules['ec2Rules'][m]['ruledata']['S'], str(ec2Resources[n])):
-                    risk = risk + int(rules['ec2Rules'][m]['riskvalue']['N'])
-                    failedRules.append(str(rules['ec2Rules'][m]['rule']['S']))
-                    print("Matched rule: " + str(rules['ec2Rules'][m]['rule']['S']))
-                    print("Resource: " + str(ec2Resources[n]))
-                    print("Riskvalue: " + rules['ec2Rules'][m]['riskvalue']['N'])
-                    print("")
-
-    for n in range(len(volumeResources)):
-        for m in range(len(rules['volRules'])):
-            if rules['volRules'][m]['active']['S'] == "Y":
-                if re.match(rules['volRules'][m]['ruledata']['S'], str(volumeResources[n])):
-                    risk = risk + int(rules['volRules'][m]['riskvalue']['N'])
-                    failedRules.append(str(rules['volRules'][m]['rule']['S']))
-                    print("Matched rule: " + str(rules['volRules'][m]['rule']['S']))
-                    print("Resource: " + str(volumeResources[n]))
-                    print("Riskvalue: " + rules['volRules'][m]['riskvalue']['N'])
-                    print("")
+    return score_template(rules, jsonTemplate)
+
+
+def score_template(rules, jsonTemplate):
+    """Scores a parsed template against the rules
+
+    Each resource is only tested against the rules indexed for its type.
+    A rule that runs out of its time budget counts as failed with its risk
+    value once, and so does a rule rejected at load time, since the template
+    was not checked against it.
+
+    Args:
+        rules: The rule_engine.RuleSet to apply
+        jsonTemplate: The parsed CloudFormation template
+
+    Returns:
+        A tuple of the total risk value and the list of rule_engine.Finding
+        objects
+
+    """
+    # Validate rules and increase risk value
+    risk = 0
+    findings = []
+    for rule, reason in rules.rejected:
+        risk = risk + rule.risk
+        findings.append(rule_engine.Finding(rule.name, rule.category, rule.risk, status=rule_engine.REJECTED))
+    timedOut = dict()
+    spent = dict()
+    for key, resource in jsonTemplate['Resources'].items():
+        for finding in rules.match(resource, timedOut, key, spent):
+            risk = risk + finding.risk
+            findings.append(finding)
+            print("Matched rule: " + finding.rule)
+            print("Resource: " + key + " " + str(resource))
+            print("Riskvalue: " + str(finding.risk))
+            print("")
+    for finding in timedOut.values():
+        risk = risk + finding.risk
+        findings.append(finding)
     print("Risk value: " +str(risk))
-    return risk, failedRules
-
-def s3_next_step(s3, bucket, risk, failedRules, template, job_id):
-    # Store data in temporary physical file
-    s3Client = boto3.client('s3', config=botocore.client.Config(signature_version='s3v4'))
-    tmp_file = tempfile.NamedTemporaryFile()
-    tmp_zip = tempfile.NamedTemporaryFile()
-    #for item in template:
-        #tmp_file.write(item)
-    tmp_file.write(template)
-    
-    
-    tmp_file.flush()
+    return risk, findings
+
+def verdict_key(rules, template):
+    """Builds the verdict cache key of a template scored against a rule set"""
+    return hashlib.sha256(template).hexdigest() + '#' + rules.fingerprint
+
+
+def get_verdict(key):
+    """Looks up the cached verdict of a template
+
+    The cache is optional, so a lookup that fails, e.g. because the table
+    is missing or throttled, is logged, counted in the VerdictCacheError
+    metric and counts as a miss.
+
+    Args:
+        key: The key returned by verdict_key
+
+    Returns:
+        A tuple of the risk value and the list of rule_engine.Finding
+        objects, or None on a cache miss
+
+    """
+    if not VERDICT_TABLE:
+        return None
+    client = clients.get_client('dynamodb')
+    try:
+        item = client.get_item(
+            TableName=VERDICT_TABLE,
+            Key={
+                'verdict': {'S': key}
+            }
+        ).get('Item')
+    except botocore.exceptions.ClientError as e:
+        print("Verdict cache lookup failed: " + str(e))
+        put_metric('VerdictCacheError', 1)
+        return None
+    # DynamoDB removes expired items lazily, so they can still be read
+    if item is None or int(item['expires']['N']) < time.time():
+        return None
+    # Verdicts cached before findings were stored as maps only hold rule names
+    if 'findings' not in item:
+        return None
+    return int(item['risk']['N']), [finding_from_item(finding['M']) for finding in item['findings']['L']]
+
+
+def finding_to_item(finding):
+    """Converts a rule_engine.Finding to a DynamoDB map"""
+    item = {
+        'rule': {'S': finding.rule},
+        'risk': {'N': str(finding.risk)},
+        'status': {'S': finding.status}
+    }
+    if finding.category is not None:
+        item['category'] = {'S': finding.category}
+    if finding.resource is not None:
+        item['resource'] = {'S': finding.resource}
+    if finding.span is not None:
+        item['span'] = {'L': [{'N': str(n)} for n in finding.span]}
+    return item
+
+
+def finding_from_item(item):
+    """Converts a DynamoDB map written by finding_to_item to a rule_engine.Finding"""
+    return rule_engine.Finding(
+        item['rule']['S'],
+        item['category']['S'] if 'category' in item else None,
+        int(item['risk']['N']),
+        item['resource']['S'] if 'resource' in item else None,
+        tuple(int(n['N']) for n in item['span']['L']) if 'span' in item else None,
+        item['status']['S'])
+
+
+def put_verdict(key, risk, findings):
+    """Caches the verdict of a template
+
+    Verdicts where a rule timed out depend on timing rather than on the
+    template, so they are not cached, nor are verdicts with a rejected rule,
+    which are rescored once the rule is fixed, nor verdicts too large for a
+    DynamoDB item. A write that fails is logged, counted in the
+    VerdictCacheError metric and skipped, as the template has already been
+    scored.
+
+    Args:
+        key: The key returned by verdict_key
+        risk: The risk value of the template
+        findings: The rule_engine.Finding objects of the template
+
+    """
+    if not VERDICT_TABLE:
+        return
+    if any(finding.status in (rule_engine.TIMED_OUT, rule_engine.REJECTED) for finding in findings):
+        return
+    item = {
+        'verdict': {'S': key},
+        'risk': {'N': str(risk)},
+        'findings': {'L': [{'M': finding_to_item(finding)} for finding in findings]},
+        'expires': {'N': str(int(time.time()) + VERDICT_TTL)}
+    }
+    # The JSON form is larger than the stored item, so it bounds its size
+    size = len(json.dumps(item))
+    if size > MAX_VERDICT_BYTES:
+        print("Verdict of {0} findings too large to cache ({1} bytes)".format(len(findings), size))
+        return
+    client = clients.get_client('dynamodb')
+    try:
+        client.put_item(TableName=VERDICT_TABLE, Item=item)
+    except botocore.exceptions.ClientError as e:
+        print("Verdict cache write failed: " + str(e))
+        put_metric('VerdictCacheError', 1)
+
+
+def put_metric(name, value, unit='Count'):
+    """Publishes a metric in the CloudWatch embedded metric format
+
+    The metric is printed to the function log, from which CloudWatch extracts
+    it without any API call.
+
+    """
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRIC_NAMESPACE,
+                'Dimensions': [[]],
+                'Metrics': [{'Name': name, 'Unit': unit}]
+            }]
+        },
+        name: value
+    }))
+
+
+def s3_next_step(s3, bucket, risk, findings, template, job_id):
+    """Routes the template based on its risk value
+
+    Low and medium risk templates are zipped in memory and stored in the
+    output bucket as valid.template.zip or flagged.template.zip, high risk
+    templates fail the job.
+
+    """
+    sse = OUTPUT_SSE if OUTPUT_SSE.lower() != 'none' else None
     # Process file based on risk value
     if risk < 5:
-        with zipfile.ZipFile(tmp_zip.name, 'w') as zip:
-            zip.write(tmp_file.name, "valid.template.json")
-            zip.close()
-            s3Client.upload_file( # Add encryption support
-                tmp_zip.name,
-                bucket,
-                'valid.template.zip')
-        tmp_file.close()
+        artifacts.put_zip(clients.get_client('s3'), bucket, 'valid.template.zip', "valid.template.json",
+                          template, OUTPUT_COMPRESSION_LEVEL, sse, OUTPUT_SSE_KMS_KEY_ID)
         put_job_success(job_id, 'Job succesful, minimal or no risk detected.')
     elif 5 <= risk < 50:
-        with zipfile.ZipFile(tmp_zip.name, 'w') as zip:
-            zip.write(tmp_file.name, "flagged.template.json")
-            zip.close()
-            s3Client.upload_file( # Add encryption support
-                tmp_zip.name,
-                bucket,
-                'flagged.template.zip')
-        tmp_file.close()
+        artifacts.put_zip(clients.get_client('s3'), bucket, 'flagged.template.zip', "flagged.template.json",
+                          template, OUTPUT_COMPRESSION_LEVEL, sse, OUTPUT_SSE_KMS_KEY_ID)
         put_job_success(job_id, 'Job succesful, medium risk detected, manual approval needed.')
     elif risk >= 50:
-        tmp_file.close()
         print("High risk file, fail pipeline")
+        failedRules = [str(finding) for finding in findings]
         put_job_failure(job_id, 'Function exception: Failed filters ' + str(failedRules))
     return 0
 
@@ -427,13 +701,23 @@ def lambda_handler(event, context):
         print("Template: " + template_file)
         
         # Get validation rules from DDB
-        rules = get_rules()
-
-        # Validate template from risk perspective. FailedRules can be used if you wish to expand the script to report failed items
-        risk, failedRules = evaluate_template(rules, template)
+        rules = get_rules(params.get('rulesTable'))
+
+        # Reuse the verdict of an identical template scored against the same rules
+        key = verdict_key(rules, template)
+        verdict = get_verdict(key)
+        if VERDICT_TABLE:
+            put_metric('VerdictCacheHit', 0 if verdict is None else 1)
+        if verdict is not None:
+            print("Verdict cache hit: " + key)
+            risk, findings = verdict
+        else:
+            # Validate template from risk perspective. Findings can be used if you wish to expand the script to report failed items
+            risk, findings = evaluate_template(rules, template)
+            put_verdict(key, risk, findings)
 
         # Based on risk, store the template in the correct S3 bucket for future process
-        s3_next_step(s3, output_bucket, risk, failedRules, template, job_id)
+        s3_next_step(s3, output_bucket, risk, findings, template, job_id)
 
     except Exception as e:
         # If any other exceptions which we didn't expect are raised
@@ -0,0 +1,87 @@
+"""Boto3 clients shared by the SecGuardRails handlers
+
+Clients are created on first use and kept for the life of the container, so
+a cold start only pays for the clients its code path calls, and warm
+invocations reuse their resolved endpoints and open connections. A client is
+kept for each service, region and set of credentials, the function's own or
+the artifact credentials passed by CodePipeline.
+"""
+
+from __future__ import print_function
+import collections
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Connections kept open per client. The stack controls read the policy, ACL
+# and public access block of 8 buckets at once with a single S3 client.
+MAX_POOL_CONNECTIONS = int(os.environ.get('MAX_POOL_CONNECTIONS', '32'))
+
+# Attempts per call, retried with the adaptive mode which also slows down
+# the client while the service throttles it
+MAX_ATTEMPTS = int(os.environ.get('MAX_ATTEMPTS', '5'))
+
+# Artifact credentials change from job to job, so only the sessions of the
+# most recent credential sets are kept, with their clients
+MAX_SESSIONS = 4
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    retries={'total_max_attempts': MAX_ATTEMPTS, 'mode': 'adaptive'}
+)
+# S3 clients sign with SigV4, as the artifact store requires for KMS
+# encrypted artifacts; the other services keep their default signers
+S3_CLIENT_CONFIG = CLIENT_CONFIG.merge(Config(signature_version='s3v4'))
+
+# Sessions by credential set, most recently used last, each with its clients
+# by (service, region)
+SESSIONS = collections.OrderedDict()
+
+# boto3 sessions are not thread safe while they create clients, and the
+# stack controls run in threads
+CLIENTS_LOCK = threading.Lock()
+
+
+def credentials_key(credentials):
+    if credentials is None:
+        return None
+    return (credentials['accessKeyId'], credentials['secretAccessKey'], credentials.get('sessionToken'))
+
+
+def get_client(service, region=None, credentials=None):
+    """Returns the client of a service, creating it on first use
+
+    Args:
+        service: The service name, e.g. 'codepipeline'
+        region: The region, or None for the function's region
+        credentials: A dictionary with accessKeyId, secretAccessKey and
+            sessionToken, such as the artifactCredentials of a CodePipeline
+            job, or None for the function's own credentials
+
+    Returns:
+        The boto3 client
+
+    """
+    key = credentials_key(credentials)
+    with CLIENTS_LOCK:
+        if key in SESSIONS:
+            SESSIONS.move_to_end(key)
+        else:
+            if key is None:
+                session = boto3.session.Session()
+            else:
+                session = boto3.session.Session(
+                    aws_access_key_id=key[0], aws_secret_access_key=key[1], aws_session_token=key[2])
+            SESSIONS[key] = (session, dict())
+            # The function's own session is never dropped
+            while len(SESSIONS) > MAX_SESSIONS + 1:
+                oldest = next(k for k in SESSIONS if k is not None)
+                del SESSIONS[oldest]
+        session, clients = SESSIONS[key]
+        client = clients.get((service, region))
+        if client is None:
+            config = S3_CLIENT_CONFIG if service == 's3' else CLIENT_CONFIG
+            client = clients[(service, region)] = session.client(service, region_name=region, config=config)
+    return client
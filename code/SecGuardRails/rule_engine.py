@@ -0,0 +1,662 @@
+"""Compiled rule engine used to validate CloudFormation templates
+
+Rules are stored in DynamoDB with rule, category, ruletype, ruledata,
+riskvalue and active attributes. They are compiled once when loaded, inactive
+rules are dropped, and the remaining rules are indexed by the CloudFormation
+resource type they apply to so each resource is only tested against its own
+rules.
+
+Two rule types are supported:
+
+regex
+    ruledata is a regex matched against str() of the resource. Each regex rule
+    also records the literal strings any match must contain. When the
+    prefilter is enabled a rule is skipped without running its regex if one
+    of those literals is missing from the resource, and every distinct literal
+    is searched for at most once per resource however many rules share it.
+
+path
+    ruledata is "<path> <operator> <value>" evaluated against the parsed
+    resource, e.g. "Properties.SecurityGroupIngress[*].CidrIp == 0.0.0.0/0".
+    The path is a dot separated list of keys relative to the resource, where
+    "*" selects every value of an object, "[*]" every item of a list and
+    "[n]" a single item. A single object is treated as a one item list, as
+    CloudFormation accepts both. The operators are ==, != (string comparison,
+    booleans compare as true/false), =~, !~ (regex search) and exists, which
+    takes no value. The rule matches when any selected value satisfies the
+    operator.
+
+Compiled rules are Rule objects, with the risk value converted to an integer
+once, and matches are returned as Finding objects naming the rule, the
+logical ID of the resource and the span of the match.
+
+Regex rules are user editable, so they are checked for backtracking when
+loaded. A pattern with nested unbounded quantifiers, such as (a+)+, can take
+exponential time and is rejected. A pattern with more than
+MAX_SEQUENTIAL_REPEATS unbounded quantifiers one after the other, such as
+^.*a.*b.*c, takes polynomial time on large resources and is flagged in the
+log. The check cannot catch every slow pattern, e.g. overlapping
+alternations like (a|aa)*, so every regex rule runs with a time budget
+covering all its matches in a template. A rule that runs out of time is
+reported as timed out and skipped for the rest of the template.
+"""
+
+from __future__ import print_function
+import hashlib
+import json
+import re
+import signal
+import sys
+import threading
+import time
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Rule categories used by the rules shipped with the workshop, mapped to the
+# CloudFormation resource type they apply to. Any other category is taken to
+# be the resource type itself, e.g. "AWS::S3::Bucket" or "S3::Bucket".
+CATEGORY_RESOURCE_TYPES = {
+    'SecurityGroup': 'EC2::SecurityGroup',
+    'EC2Instance': 'EC2::Instance',
+    'Volume': 'EC2::Volume',
+}
+
+# Regex rules with more unbounded quantifiers of broad classes such as .* in a
+# row than this are flagged and run with a time budget
+MAX_SEQUENTIAL_REPEATS = 2
+
+REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+# Status of a Finding
+MATCHED = 'matched'
+TIMED_OUT = 'timed out'
+REJECTED = 'rejected'
+
+
+class RuleTimeout(Exception):
+    """Raised when a regex rule runs out of its time budget"""
+
+
+class RuleRejected(Exception):
+    """Raised when a regex rule is too prone to backtracking to be run
+
+    Attributes:
+        rule: The Rule that was rejected
+
+    """
+
+    def __init__(self, rule, message):
+        super(RuleRejected, self).__init__(message)
+        self.rule = rule
+
+
+class Rule(object):
+    """A compiled rule
+
+    Attributes:
+        name: The name of the rule
+        category: The category of the rule, e.g. "SecurityGroup"
+        resourceType: The resource type the category applies to
+        ruletype: 'regex' or 'path'
+        risk: The risk value
+        pattern: The compiled regex of a regex rule
+        literals: The literals every match of a regex rule contains
+        flagged: Whether a regex rule is prone to polynomial backtracking
+        path: The compiled path of a path rule
+        op: The operator of a path rule
+        value: The value of a path rule, compiled for =~ and !~
+
+    """
+
+    __slots__ = ('name', 'category', 'resourceType', 'ruletype', 'risk', 'pattern', 'literals', 'flagged',
+                 'path', 'op', 'value')
+
+    def __init__(self, name, category, ruletype, risk):
+        self.name = name
+        # Rules of a category share the same strings
+        self.category = sys.intern(category)
+        self.resourceType = sys.intern(CATEGORY_RESOURCE_TYPES.get(category, category))
+        self.ruletype = ruletype
+        self.risk = risk
+        self.pattern = None
+        self.literals = ()
+        self.flagged = False
+        self.path = None
+        self.op = None
+        self.value = None
+
+    def __repr__(self):
+        return 'Rule({0!r}, {1!r}, {2!r}, {3})'.format(self.name, self.category, self.ruletype, self.risk)
+
+
+class Finding(object):
+    """A rule matched by a template
+
+    Attributes:
+        rule: The name of the rule
+        category: The category of the rule
+        risk: The risk value added by the finding
+        resource: The logical ID of the resource, None when unknown
+        span: The (start, end) of the regex match in str() of the resource,
+            None for path rules and rules that did not run
+        status: MATCHED, TIMED_OUT for a rule that ran out of its time
+            budget or REJECTED for a rule that was not loaded
+
+    """
+
+    __slots__ = ('rule', 'category', 'risk', 'resource', 'span', 'status')
+
+    def __init__(self, rule, category, risk, resource=None, span=None, status=MATCHED):
+        self.rule = rule
+        self.category = category
+        self.risk = risk
+        self.resource = resource
+        self.span = span
+        self.status = status
+
+    def __str__(self):
+        if self.status == MATCHED:
+            return self.rule
+        return '{0} ({1})'.format(self.rule, self.status)
+
+    def __repr__(self):
+        return 'Finding({0!r}, {1!r}, {2}, resource={3!r}, span={4!r}, status={5!r})'.format(
+            self.rule, self.category, self.risk, self.resource, self.span, self.status)
+
+
+def backtracking_risk(pattern):
+    """Looks for regex constructs that can backtrack super-linearly
+
+    Args:
+        pattern: The compiled regex
+
+    Returns:
+        A tuple of whether the pattern has nested unbounded quantifiers and
+        the largest number of unbounded quantifiers found one after the other
+
+    """
+    return count_repeats(sre_parse.parse(pattern.pattern, pattern.flags), False)
+
+
+def count_repeats(parsed, inRepeat):
+    """Counts the unbounded quantifiers along a parsed regex
+
+    Args:
+        parsed: A parsed regex or subpattern
+        inRepeat: Whether parsed is the body of an unbounded quantifier
+
+    Returns:
+        A tuple of whether an unbounded quantifier is nested in another one and
+        the number of unbounded quantifiers in sequence
+
+    """
+    nested = False
+    count = 0
+    for op, av in parsed:
+        if op in REPEATS:
+            unbounded = av[1] == sre_parse.MAXREPEAT
+            if unbounded and inRepeat:
+                nested = True
+            bodyNested, bodyCount = count_repeats(av[2], inRepeat or unbounded)
+            nested = nested or bodyNested
+            count += bodyCount + (1 if unbounded and is_broad(av[2]) else 0)
+        elif op == sre_parse.SUBPATTERN:
+            bodyNested, bodyCount = count_repeats(av[-1], inRepeat)
+            nested = nested or bodyNested
+            count += bodyCount
+        elif op == sre_parse.BRANCH:
+            counts = [0]
+            for branch in av[1]:
+                bodyNested, bodyCount = count_repeats(branch, inRepeat)
+                nested = nested or bodyNested
+                counts.append(bodyCount)
+            count += max(counts)
+    return nested, count
+
+
+def is_broad(parsed):
+    """Checks whether a repeated subpattern can match almost any character
+
+    Only repeats of broad classes like . or [^x] can overlap with the rest of
+    the pattern enough to backtrack badly; \\s* or [0-9]+ next to a literal
+    cannot.
+
+    Args:
+        parsed: The parsed body of a repeat
+
+    Returns:
+        True if the body contains a broad class or a nested group
+
+    """
+    for op, av in parsed:
+        if op in (sre_parse.ANY, sre_parse.NOT_LITERAL):
+            return True
+        if op == sre_parse.IN and av and av[0][0] == sre_parse.NEGATE:
+            return True
+        if op in (sre_parse.SUBPATTERN, sre_parse.BRANCH) or op in REPEATS:
+            return True
+    return False
+
+
+def raise_timeout(signum, frame):
+    raise RuleTimeout()
+
+
+def match_within(pattern, text, seconds):
+    """Matches a regex, giving up after a number of seconds
+
+    The SIGALRM handler must be raise_timeout, as installed by RuleSet.match.
+
+    Args:
+        pattern: The compiled regex
+        text: The string to match
+        seconds: The time budget, more than 0
+
+    Returns:
+        The match object, or None
+
+    Raises:
+        RuleTimeout: The budget ran out
+
+    """
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        return pattern.match(text)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def required_literals(pattern):
+    """Finds the literal strings that every match of a regex must contain
+
+    Only literals that cannot be skipped are returned: those outside of
+    alternations, optional repeats and lookarounds. Case-insensitive patterns
+    have no required literals.
+
+    Args:
+        pattern: The compiled regex
+
+    Returns:
+        A tuple of the required literal strings, longest first
+
+    """
+    if pattern.flags & re.IGNORECASE:
+        return ()
+    literals = set()
+    collect_literals(sre_parse.parse(pattern.pattern, pattern.flags), literals)
+    return tuple(sorted(literals, key=len, reverse=True))
+
+
+def collect_literals(parsed, literals):
+    """Adds the runs of mandatory literal characters in a parsed regex
+
+    Args:
+        parsed: A parsed regex or subpattern
+        literals: The set the literal runs are added to
+
+    """
+    run = []
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            literals.add(''.join(run))
+            run = []
+        if op == sre_parse.SUBPATTERN:
+            # (group, add_flags, del_flags, pattern)
+            if not av[1] & re.IGNORECASE:
+                collect_literals(av[-1], literals)
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            collect_literals(av[2], literals)
+    if run:
+        literals.add(''.join(run))
+
+
+PATH_RULE = re.compile(r'^\s*(?P<path>[^\s=!]+)\s*(?P<op>==|!=|=~|!~|\s+exists)\s*(?P<value>.*?)\s*$')
+PATH_STEP = re.compile(r'([^.\[\]]+)|\[(\*|\d+)\]')
+
+
+def compile_path(path):
+    """Parses a path into the steps used to walk a resource
+
+    Args:
+        path: The path, e.g. "Properties.SecurityGroupIngress[*].CidrIp"
+
+    Returns:
+        A tuple of steps. Each step is a key string, '*' for every value of an
+        object, '[*]' for every item of a list or an integer list index.
+
+    Raises:
+        Exception: The path cannot be parsed
+
+    """
+    steps = []
+    position = 0
+    while position < len(path):
+        if path[position] == '.' and steps:
+            position += 1
+        step = PATH_STEP.match(path, position)
+        if step is None:
+            raise Exception('Invalid path "{0}" at position {1}'.format(path, position))
+        if step.group(1) is not None:
+            steps.append(step.group(1))
+        elif step.group(2) == '*':
+            steps.append('[*]')
+        else:
+            steps.append(int(step.group(2)))
+        position = step.end()
+    return tuple(steps)
+
+
+def select_path(steps, node):
+    """Selects the values a compiled path leads to in a resource
+
+    Args:
+        steps: The steps returned by compile_path
+        node: The resource, or any part of it
+
+    Returns:
+        The list of selected values
+
+    """
+    nodes = [node]
+    for step in steps:
+        selected = []
+        for node in nodes:
+            if step == '*':
+                if isinstance(node, dict):
+                    selected.extend(node.values())
+            elif step == '[*]':
+                if isinstance(node, list):
+                    selected.extend(node)
+                else:
+                    selected.append(node)
+            elif isinstance(step, int):
+                if isinstance(node, list) and step < len(node):
+                    selected.append(node[step])
+                elif not isinstance(node, list) and step == 0:
+                    selected.append(node)
+            elif isinstance(node, dict) and step in node:
+                selected.append(node[step])
+        nodes = selected
+        if not nodes:
+            break
+    return nodes
+
+
+def scalar_text(value):
+    """Converts a template value to the string path rules compare against"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def compile_path_rule(name, ruledata):
+    """Compiles the ruledata of a path rule
+
+    Args:
+        name: The name of the rule
+        ruledata: The "<path> <operator> <value>" expression
+
+    Returns:
+        A tuple of the compiled path, the operator and the value
+
+    Raises:
+        Exception: The expression cannot be parsed
+
+    """
+    expression = PATH_RULE.match(ruledata)
+    if expression is None:
+        raise Exception('Rule "{0}" has an invalid path expression "{1}"'.format(name, ruledata))
+    op = expression.group('op').strip()
+    value = expression.group('value')
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        value = value[1:-1]
+    if op == 'exists':
+        if value:
+            raise Exception('Rule "{0}": exists takes no value'.format(name))
+    elif op in ('=~', '!~'):
+        try:
+            value = re.compile(value)
+        except re.error as e:
+            raise Exception('Rule "{0}" has an invalid pattern: {1}'.format(name, e))
+    return compile_path(expression.group('path')), op, value
+
+
+def path_matches(rule, resource):
+    """Evaluates a compiled path rule against a resource
+
+    Args:
+        rule: The compiled path rule
+        resource: The resource from the parsed template
+
+    Returns:
+        True if any selected value satisfies the operator
+
+    """
+    values = select_path(rule.path, resource)
+    op = rule.op
+    if op == 'exists':
+        return len(values) > 0
+    for value in values:
+        if isinstance(value, (dict, list)):
+            continue
+        text = scalar_text(value)
+        if op == '==':
+            if text == rule.value:
+                return True
+        elif op == '!=':
+            if text != rule.value:
+                return True
+        elif op == '=~':
+            if rule.value.search(text):
+                return True
+        elif not rule.value.search(text):
+            return True
+    return False
+
+
+def compile_rule(item):
+    """Compiles a single rule item read from DynamoDB
+
+    Args:
+        item: The DynamoDB item of the rule
+
+    Returns:
+        The Rule, with either the compiled regex or the compiled path
+        expression
+
+    Raises:
+        RuleRejected: The regex has nested unbounded quantifiers
+        Exception: The rule type is not supported or the pattern is invalid
+
+    """
+    name = item['rule']['S']
+    ruletype = item.get('ruletype', {'S': 'regex'})['S']
+    rule = Rule(name, item['category']['S'], ruletype, int(item['riskvalue']['N']))
+    if ruletype == 'regex':
+        try:
+            rule.pattern = re.compile(item['ruledata']['S'])
+        except re.error as e:
+            raise Exception('Rule "{0}" has an invalid pattern: {1}'.format(name, e))
+        rule.literals = required_literals(rule.pattern)
+        nested, repeats = backtracking_risk(rule.pattern)
+        if nested:
+            raise RuleRejected(rule, 'Rule "{0}" has nested unbounded quantifiers'.format(name))
+        rule.flagged = repeats > MAX_SEQUENTIAL_REPEATS
+        if rule.flagged:
+            print('Rule "{0}" has {1} unbounded quantifiers in sequence and may run out of its time budget'.format(
+                name, repeats))
+    elif ruletype == 'path':
+        rule.path, rule.op, rule.value = compile_path_rule(name, item['ruledata']['S'])
+    else:
+        raise Exception('Rule "{0}" has unsupported ruletype "{1}"'.format(name, ruletype))
+    return rule
+
+
+class RuleSet(object):
+    """Active rules indexed by the resource type they apply to
+
+    Args:
+        items: The rule items read from DynamoDB
+        prefilter: Whether to skip rules whose required literals are missing
+        budget: Seconds a regex rule may spend on a template, 0 for no limit
+
+    Attributes:
+        rejected: (Rule, reason) pairs for the rules that were not loaded
+        fingerprint: SHA-256 of the rule items, which changes whenever any
+            rule is added, removed or edited
+
+    """
+
+    def __init__(self, items, prefilter=True, budget=1.0):
+        self.prefilter = prefilter
+        self.budget = budget
+        self.categories = dict()
+        self.rejected = []
+        self.fingerprint = hashlib.sha256(json.dumps(
+            sorted(items, key=lambda item: item['rule']['S']), sort_keys=True).encode('utf-8')).hexdigest()
+        for item in items:
+            if item['active']['S'] != "Y":
+                continue
+            try:
+                rule = compile_rule(item)
+            except RuleRejected as e:
+                print(e)
+                self.rejected.append((e.rule, str(e)))
+                continue
+            self.categories.setdefault(rule.resourceType, []).append(rule)
+        self.byType = dict()
+
+    def __len__(self):
+        return sum(len(rules) for rules in self.categories.values())
+
+    def __repr__(self):
+        return 'RuleSet({0})'.format(
+            dict((k, [rule.name for rule in v]) for k, v in self.categories.items()))
+
+    def for_type(self, resourceType):
+        """Returns the rules that apply to a resource type
+
+        A category applies to every resource type it is part of, so
+        "EC2::SecurityGroup" also covers "AWS::EC2::SecurityGroupIngress".
+        The result is remembered for each resource type seen.
+
+        Args:
+            resourceType: The Type of a template resource
+
+        Returns:
+            The list of Rule objects
+
+        """
+        rules = self.byType.get(resourceType)
+        if rules is None:
+            rules = []
+            for category, categoryRules in self.categories.items():
+                if category in resourceType:
+                    rules.extend(categoryRules)
+            self.byType[resourceType] = rules
+        return rules
+
+    def match(self, resource, timedOut=None, logicalId=None, spent=None):
+        """Finds the rules matched by a resource
+
+        The resource is only serialized with str() if a regex rule needs it.
+        Regex rules are interrupted with SIGALRM when they run out of their
+        budget, which is only possible in the main thread. In other threads
+        a rule that has run out of its budget is only stopped once its match
+        returns.
+
+        Args:
+            resource: The resource from the parsed template
+            timedOut: A dictionary of the findings of the rules that ran out
+                of time, by rule name. Rules in it are skipped and rules that
+                run out of time are added to it.
+            logicalId: The logical ID of the resource, recorded in the
+                findings
+            spent: A dictionary of the seconds each regex rule has spent on
+                the template so far, by rule name, updated in place. The
+                budget covers all the matches of a rule recorded in it, or
+                each match on its own when it is None.
+
+        Returns:
+            The list of Finding objects of the matched rules
+
+        """
+        interrupt = self.budget > 0 and threading.current_thread() is threading.main_thread()
+        if interrupt:
+            previous = signal.signal(signal.SIGALRM, raise_timeout)
+        try:
+            return self.match_rules(resource, timedOut, logicalId, spent, interrupt)
+        finally:
+            if interrupt:
+                signal.signal(signal.SIGALRM, previous)
+
+    def match_rules(self, resource, timedOut, logicalId, spent, interrupt):
+        """Matches the rules of a resource once the SIGALRM handler is set, see match"""
+        matched = []
+        present = dict()
+        resourceText = None
+        for rule in self.for_type(resource['Type']):
+            if rule.ruletype == 'path':
+                if path_matches(rule, resource):
+                    matched.append(Finding(rule.name, rule.category, rule.risk, logicalId))
+                continue
+            if timedOut is not None and rule.name in timedOut:
+                continue
+            if resourceText is None:
+                resourceText = str(resource)
+            if self.prefilter and not has_literals(rule, resourceText, present):
+                continue
+            if self.budget <= 0:
+                found = rule.pattern.match(resourceText)
+                if found:
+                    matched.append(Finding(rule.name, rule.category, rule.risk, logicalId, found.span()))
+                continue
+            used = spent.get(rule.name, 0.0) if spent is not None else 0.0
+            start = time.perf_counter()
+            try:
+                if interrupt:
+                    found = match_within(rule.pattern, resourceText, self.budget - used)
+                else:
+                    found = rule.pattern.match(resourceText)
+                outOfTime = False
+            except RuleTimeout:
+                found = None
+                outOfTime = True
+            used += time.perf_counter() - start
+            if spent is not None:
+                spent[rule.name] = used
+            if outOfTime or used >= self.budget:
+                print('Rule "{0}" ran out of its {1}s time budget'.format(rule.name, self.budget))
+                if timedOut is not None:
+                    timedOut[rule.name] = Finding(rule.name, rule.category, rule.risk, logicalId, status=TIMED_OUT)
+                continue
+            if found:
+                matched.append(Finding(rule.name, rule.category, rule.risk, logicalId, found.span()))
+        return matched
+
+
+def has_literals(rule, resourceText, present):
+    """Checks that a resource contains all the required literals of a rule
+
+    Args:
+        rule: The compiled rule
+        resourceText: The resource serialized with str()
+        present: Literals already looked up in this resource, updated in place
+
+    Returns:
+        False if a required literal is missing, True otherwise
+
+    """
+    for literal in rule.literals:
+        found = present.get(literal)
+        if found is None:
+            found = present[literal] = literal in resourceText
+        if not found:
+            return False
+    return True
@@ -1,329 +1,542 @@
-"""Summary
-Attributes:
-    AWS_CIS_BENCHMARK_VERSION (str): Description
-    CONFIG_RULE (bool): Description
-    CONTROL_1_1_DAYS (int): Description
-    REGIONS (list): Description
-    SCRIPT_OUTPUT_JSON (bool): Description
-"""
-
-from __future__ import print_function
-import json
-import csv
-import time
-import sys
-import re
-import tempfile
-from datetime import datetime
-import boto3
-import botocore
-import traceback
-import zipfile
-
-# Would you like to print the results as JSON to output?
-SCRIPT_OUTPUT_JSON = True
-code_pipeline = boto3.client('codepipeline')
-EC2_CLIENT = boto3.client('ec2')
-cf = boto3.client('cloudformation')
-
-
-def put_job_success(job, message):
-    """Notify CodePipeline of a successful job
-
-    Args:
-        job: The CodePipeline job ID
-        message: A message to be logged relating to the job status
-
-    Raises:
-        Exception: Any exception thrown by .put_job_success_result()
-
-    """
-    print('Putting job success')
-    print(message)
-    code_pipeline.put_job_success_result(jobId=job)
-
-
-def put_job_failure(job, message):
-    """Notify CodePipeline of a failed job
-
-    Args:
-        job: The CodePipeline job ID
-        message: A message to be logged relating to the job status
-
-    Raises:
-        Exception: Any exception thrown by .put_job_failure_result()
-
-    """
-    print('Putting job failure')
-    print(message)
-    code_pipeline.put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
-
-
-def continue_job_later(job, message):
-    """Notify CodePipeline of a continuing job
-
-    This will cause CodePipeline to invoke the function again with the
-    supplied continuation token.
-
-    Args:
-        job: The JobID
-        message: A message to be logged relating to the job status
-        continuation_token: The continuation token
-
-    Raises:
-        Exception: Any exception thrown by .put_job_success_result()
-
-    """
-
-    # Use the continuation token to keep track of any job execution state
-    # This data will be available when a new job is scheduled to continue the current execution
-    continuation_token = json.dumps({'previous_job_id': job})
-
-    print('Putting job continuation')
-    print(message)
-    code_pipeline.put_job_success_result(jobId=job, continuationToken=continuation_token)
-
-
-def stack_exists(stack):
-    """Check if a stack exists or not
-
-    Args:
-        stack: The stack to check
-
-    Returns:
-        True or False depending on whether the stack exists
-
-    Raises:
-        Any exceptions raised .describe_stacks() besides that
-        the stack doesn't exist.
-
-    """
-    try:
-        cf.describe_stacks(StackName=stack)
-        return True
-    except botocore.exceptions.ClientError as e:
-        if "does not exist" in e.response['Error']['Message']:
-            return False
-        else:
-            raise e
-
-
-def delete_stack(stack):
-    """CloudFormation stack deletion
-
-    Args:
-        stack: The stack to be created
-
-    Throws:
-        Exception: Any exception thrown by .create_stack()
-    """
-    cf.delete_stack(StackName=stack)
-
-
-# --- Security Groups ---
-# 4.1 Ensure no security groups allow ingress from 0.0.0.0/0 to port 22 (Scored)
-def control_4_1_ensure_ssh_not_open_to_world(regions, stackName):
-    """Summary
-
-    Returns:
-        TYPE: Description
-    """
-    result = True
-    failReason = ""
-    offenders = []
-    control = "4.1"
-    description = "Ensure that security groups allow ingress from approved CIDR range to port 22"
-    scored = True
-    for n in regions:
-        client = boto3.client('ec2', region_name=n)
-        response = client.describe_security_groups(
-            Filters=[{'Name': 'tag:aws:cloudformation:stack-name', 'Values': [stackName]}])
-        for m in response['SecurityGroups']:
-            if "1.2.3.4/32" not in str(m['IpPermissions']):
-                for o in m['IpPermissions']:
-                    try:
-                        if int(o['FromPort']) <= 22 <= int(o['ToPort']):
-                            result = False
-                            failReason = "Found Security Group with port 22 open to the wrong source IP range. Allowed IP is: 1.2.3.4/32"
-                            offenders.append(str(m['GroupId']))
-                    except:
-                        if str(o['IpProtocol']) == "-1":
-                            result = False
-                            failReason = "Found Security Group with port 22 open to the wrong source IP range. Allowed IP is: 1.2.3.4/32"
-                            offenders.append(str(n) + " : " + str(m['GroupId']))
-    return {'Result': result, 'failReason': failReason, 'Offenders': offenders, 'ScoredControl': scored,
-            'Description': description, 'ControlId': control}
-
-# --- S3 Access control ---
-# 4.2 Ensure S3 bucket is not publicly accessible
-def control_4_2_no_global_s3(stackName):
-    """Summary
-    Returns:
-        TYPE: Description
-    """
-
-    # Getting the s3 bucket name first from cloudformation
-    cfn = boto3.client('cloudformation')
-    cfnResourceBucketInfo = cfn.describe_stack_resource(StackName=stackName,LogicalResourceId='S3Bucket')
-    s3BucketName = cfnResourceBucketInfo['StackResourceDetail']['PhysicalResourceId']
-
-    hasPassed = True
-    failReason = ""
-    offenders = []
-    control = "4.2"
-    description = "Ensure that there are no S3 elements exposed to the public"
-    scored = True
-    client = boto3.client('s3')
-
-    # First check bucket policy
-    try:
-        response = client.get_bucket_policy(Bucket=s3BucketName)
-        policyJson = json.loads(response['Policy'])
-        for statement in policyJson['Statement']:
-            print(statement)
-            if (statement['Principal'] and ('*' in statement['Principal'])) and (statement['Effect'] and ('Allow' in statement['Effect'])) and (statement['Action'] and ('*' in statement['Action'])):
-                hasPassed = False
-                failReason = 'Bucket [' + s3BucketName + '] has Allow policy for everyone.'
-                offenders.append(s3BucketName)
-    except botocore.exceptions.ClientError as exp:
-        if 'NoSuchBucketPolicy' in str(exp):
-            # no policy is fine
-            hasPassed = True
-
-    if hasPassed:
-        # check secondary ACL properties
-        try:
-            aclResponse = client.get_bucket_acl(Bucket=s3BucketName)
-            for aGrant in aclResponse['Grants']:
-                # contains definitions for all users then it should be invalid
-                if (aGrant['Grantee']['Type'] == 'Group') and (aGrant['Grantee']['URI']) and ('groups/global/AllUsers' in aGrant['Grantee']['URI']):
-                    print ('Found information about Global All users. This is not permitted')
-                    hasPassed = False
-                    offenders.append(s3BucketName)
-                    failReason = s3BucketName + " contains ACL specifications for All Users. Update S3 AccessControl property"
-        except botocore.exceptions.ClientError as expAcl:
-            print('problems extracting ACL information')
-            hasPassed = False
-            offenders.append(s3BucketName)
-            failReason = s3BucketName + " cannot read ACL information. Please check permissions on this lambda script"
-
-    return {'Result': hasPassed, 'failReason': failReason, 'Offenders': offenders, 'ScoredControl': scored,
-            'Description': description, 'ControlId': control}
-
-def get_regions():
-    region_response = EC2_CLIENT.describe_regions()
-    regions = [region['RegionName'] for region in region_response['Regions']]
-    return regions
-
-def json_output(controlResult):
-    """Summary
-
-    Args:
-        controlResult (TYPE): Description
-
-    Returns:
-        TYPE: Description
-    """
-    inner = dict()
-    outer = dict()
-    for m in range(len(controlResult)):
-        inner = dict()
-        for n in range(len(controlResult[m])):
-            x = int(controlResult[m][n]['ControlId'].split('.')[1])
-            inner[x] = controlResult[m][n]
-        y = controlResult[m][0]['ControlId'].split('.')[0]
-        outer[y] = inner
-    print("JSON output:")
-    print("-------------------------------------------------------")
-    print(json.dumps(outer, sort_keys=True, indent=4, separators=(',', ': ')))
-    print("-------------------------------------------------------")
-    print("\n")
-    print("Summary:")
-    print(shortAnnotation(controlResult))
-    print("\n")
-    return 0
-
-
-def shortAnnotation(controlResult):
-    """Summary
-
-    Args:
-        controlResult (TYPE): Description
-
-    Returns:
-        TYPE: Description
-    """
-    annotation = []
-    longAnnotation = False
-    for m, _ in enumerate(controlResult):
-        for n in range(len(controlResult[m])):
-            if controlResult[m][n]['Result'] is False:
-                if len(str(annotation)) < 220:
-                    annotation.append(controlResult[m][n]['ControlId'])
-                else:
-                    longAnnotation = True
-    if longAnnotation:
-        annotation.append("etc")
-        return "{\"Failed\":" + json.dumps(annotation) + "}"
-    else:
-        return "{\"Failed\":" + json.dumps(annotation) + "}"
-
-
-def lambda_handler(event, context):
-    """Summary
-
-    Args:
-        event (TYPE): Description
-        context (TYPE): Description
-
-    Returns:
-        TYPE: Description
-    """
-    # Run all control validations.
-    # The control object is a dictionary with the value
-    # result : Boolean - True/False
-    # failReason : String - Failure description
-    # scored : Boolean - True/False
-    # Check if the script is initiade from AWS Config Rules
-    # Print the entire event for tracking
-    print("Received event: " + json.dumps(event, indent=2))
-    # Extract the Job ID
-    job_id = event['CodePipeline.job']['id']
-    # Globally used resources
-    region_list = get_regions()
-    stackName = event['CodePipeline.job']['data']['actionConfiguration']['configuration']['UserParameters']
-    print("stackName: " + stackName)
-
-    # Run individual controls.
-    # Comment out unwanted controls
-    control4 = []
-    control_4_1_result = control_4_1_ensure_ssh_not_open_to_world(region_list, stackName)
-    print('control_4_1_result: ' + str(control_4_1_result['Result']))
-    control4.append(control_4_1_result)
-
-    # Running 4.2 control for s3 protection
-    control_4_2_result = control_4_2_no_global_s3(stackName)
-    print('control_4_2_result: ' + str(control_4_2_result['Result']))
-    control4.append(control_4_2_result)
-
-    # Join results
-    controls = []
-    controls.append(control4)
-
-    # Build JSON structure for console output if enabled
-    if SCRIPT_OUTPUT_JSON:
-        json_output(controls)
-
-    # iterate through controls for error checks
-    for control in controls:
-        for controlspec in control:
-            if controlspec['Result'] is False:
-                print("\n")
-                if stack_exists(stackName):
-                    delete_stack(stackName)
-                put_job_failure(job_id, controlspec['failReason'])
-                return
-
-    # found nothing and is good to go
-    print("\n")
+"""Summary
+Attributes:
+    AWS_CIS_BENCHMARK_VERSION (str): Description
+    CONFIG_RULE (bool): Description
+    CONTROL_1_1_DAYS (int): Description
+    REGIONS (list): Description
+    SCRIPT_OUTPUT_JSON (bool): Description
+"""
+
+from __future__ import print_function
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import botocore
+
+from . import clients
+
+# Would you like to print the results as JSON to output?
+SCRIPT_OUTPUT_JSON = True
+# Describe calls made at the same time
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '8'))
+# Values accepted by a single describe filter
+FILTER_VALUES_LIMIT = 200
+# Seconds each control may run, from its own start, before it is failed
+CONTROL_TIMEOUT = float(os.environ.get('CONTROL_TIMEOUT', '30'))
+# Lookups made for each bucket by control 4.2
+BUCKET_LOOKUPS = 3
+
+
+def put_job_success(job, message):
+    """Notify CodePipeline of a successful job
+
+    Args:
+        job: The CodePipeline job ID
+        message: A message to be logged relating to the job status
+
+    Raises:
+        Exception: Any exception thrown by .put_job_success_result()
+
+    """
+    print('Putting job success')
+    print(message)
+    clients.get_client('codepipeline').put_job_success_result(jobId=job)
+
+
+def put_job_failure(job, message):
+    """Notify CodePipeline of a failed job
+
+    Args:
+        job: The CodePipeline job ID
+        message: A message to be logged relating to the job status
+
+    Raises:
+        Exception: Any exception thrown by .put_job_failure_result()
+
+    """
+    print('Putting job failure')
+    print(message)
+    clients.get_client('codepipeline').put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
+
+
+def continue_job_later(job, message):
+    """Notify CodePipeline of a continuing job
+
+    This will cause CodePipeline to invoke the function again with the
+    supplied continuation token.
+
+    Args:
+        job: The JobID
+        message: A message to be logged relating to the job status
+        continuation_token: The continuation token
+
+    Raises:
+        Exception: Any exception thrown by .put_job_success_result()
+
+    """
+
+    # Use the continuation token to keep track of any job execution state
+    # This data will be available when a new job is scheduled to continue the current execution
+    continuation_token = json.dumps({'previous_job_id': job})
+
+    print('Putting job continuation')
+    print(message)
+    clients.get_client('codepipeline').put_job_success_result(jobId=job, continuationToken=continuation_token)
+
+
+# Controls registered with the control decorator, in registration order
+CONTROLS = []
+
+
+def control(controlId, description, scored=True):
+    """Registers a control function
+
+    The function is called with the stack inventory and returns a dictionary
+    with Result, failReason and Offenders. The ControlId, Description and
+    ScoredControl given here are added to it by run_controls.
+
+    Args:
+        controlId (str): The CIS control number, e.g. "4.1"
+        description (str): What the control checks
+        scored (bool): Whether the control is scored
+
+    Returns:
+        The decorator
+    """
+    def register(function):
+        CONTROLS.append({'ControlId': controlId, 'Description': description, 'ScoredControl': scored,
+                         'function': function})
+        return function
+    return register
+
+
+def run_controls(inventory, controls=None, timeout=None):
+    """Runs controls concurrently
+
+    A control that raises an exception, or that has not finished within the
+    timeout of its own start, fails with the reason in failReason. Controls
+    queued behind the MAX_WORKERS running ones get their full timeout once
+    they start. Threads cannot be stopped, so a control that timed out keeps
+    running in the background and holds its worker; the wait is therefore
+    bounded by one timeout per batch of MAX_WORKERS controls, and controls
+    still queued by then fail without having run.
+
+    Args:
+        inventory (dict): Physical IDs of the stack resources by type
+        controls (list): The registered controls to run, all by default
+        timeout (float): Seconds each control may run, CONTROL_TIMEOUT by default
+
+    Returns:
+        list: The control results grouped by section, e.g. [[4.1, 4.2]], as
+        consumed by json_output and shortAnnotation
+    """
+    if controls is None:
+        controls = CONTROLS
+    if timeout is None:
+        timeout = CONTROL_TIMEOUT
+    results = []
+    workers = max(1, min(MAX_WORKERS, len(controls)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # Start times of the controls by index, guarded by the condition, which
+    # is notified whenever a control starts or finishes
+    started = dict()
+    condition = threading.Condition()
+
+    def notify(future=None):
+        with condition:
+            condition.notify()
+
+    def run(index, spec):
+        with condition:
+            started[index] = time.monotonic()
+            condition.notify()
+        return spec['function'](inventory)
+
+    try:
+        futures = [executor.submit(run, index, spec) for index, spec in enumerate(controls)]
+        for future in futures:
+            future.add_done_callback(notify)
+        limit = timeout * -(-len(controls) // workers)
+        end = time.monotonic() + limit
+        pending = set(range(len(futures)))
+        # Wait until every control has finished, run out of its own time or
+        # the overall limit is reached, waking up at the next deadline
+        with condition:
+            while True:
+                now = time.monotonic()
+                pending = set(index for index in pending if not futures[index].done() and
+                              (index not in started or now < started[index] + timeout))
+                if not pending or now >= end:
+                    break
+                deadlines = [started[index] + timeout for index in pending if index in started]
+                condition.wait(min(deadlines + [end]) - now)
+            startTimes = dict(started)
+        for index, (spec, future) in enumerate(zip(controls, futures)):
+            if not future.done() and index not in startTimes and future.cancel():
+                result = {'Result': False, 'Offenders': [],
+                          'failReason': "Control {0} did not start within {1}s".format(spec['ControlId'], limit)}
+            elif not future.done():
+                result = {'Result': False, 'Offenders': [],
+                          'failReason': "Control {0} did not finish within {1}s".format(spec['ControlId'], timeout)}
+            elif future.exception() is not None:
+                result = {'Result': False, 'Offenders': [],
+                          'failReason': "Control {0} failed: {1}".format(spec['ControlId'], future.exception())}
+            else:
+                result = future.result()
+            result.update(ControlId=spec['ControlId'], Description=spec['Description'],
+                          ScoredControl=spec['ScoredControl'])
+            print('control_' + spec['ControlId'].replace('.', '_') + '_result: ' + str(result['Result']))
+            results.append(result)
+    finally:
+        executor.shutdown(wait=False)
+
+    sections = dict()
+    for result in results:
+        sections.setdefault(result['ControlId'].split('.')[0], []).append(result)
+    return [sorted(sections[section], key=lambda result: int(result['ControlId'].split('.')[1]))
+            for section in sorted(sections, key=int)]
+
+
+def stack_exists(stack):
+    """Check if a stack exists or not
+
+    Args:
+        stack: The stack to check
+
+    Returns:
+        True or False depending on whether the stack exists
+
+    Raises:
+        Any exceptions raised .describe_stacks() besides that
+        the stack doesn't exist.
+
+    """
+    try:
+        clients.get_client('cloudformation').describe_stacks(StackName=stack)
+        return True
+    except botocore.exceptions.ClientError as e:
+        if "does not exist" in e.response['Error']['Message']:
+            return False
+        else:
+            raise e
+
+
+def delete_stack(stack):
+    """CloudFormation stack deletion
+
+    Args:
+        stack: The stack to be created
+
+    Throws:
+        Exception: Any exception thrown by .create_stack()
+    """
+    clients.get_client('cloudformation').delete_stack(StackName=stack)
+
+
+# --- Security Groups ---
+def describe_security_groups(client, groupIds):
+    """Describes security groups by ID
+
+    The IDs are split into batches of FILTER_VALUES_LIMIT, described
+    concurrently. Groups that no longer exist are left out.
+
+    Args:
+        client: The EC2 client of the region the groups are in
+        groupIds: The list of security group IDs
+
+    Returns:
+        The list of security groups
+
+    """
+    def describe_batch(batch):
+        groups = []
+        paginator = client.get_paginator('describe_security_groups')
+        for page in paginator.paginate(Filters=[{'Name': 'group-id', 'Values': batch}]):
+            groups.extend(page['SecurityGroups'])
+        return groups
+
+    batches = [groupIds[i:i + FILTER_VALUES_LIMIT] for i in range(0, len(groupIds), FILTER_VALUES_LIMIT)]
+    if len(batches) <= 1:
+        return [group for batch in batches for group in describe_batch(batch)]
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(batches))) as executor:
+        return [group for groups in executor.map(describe_batch, batches) for group in groups]
+
+
+# 4.1 Ensure no security groups allow ingress from 0.0.0.0/0 to port 22 (Scored)
+@control("4.1", "Ensure that security groups allow ingress from approved CIDR range to port 22")
+def control_4_1_ensure_ssh_not_open_to_world(inventory):
+    """Summary
+
+    Args:
+        inventory (dict): Physical IDs of the stack resources by type
+
+    Returns:
+        TYPE: Description
+    """
+    result = True
+    failReason = ""
+    offenders = []
+    n = clients.get_client('cloudformation').meta.region_name
+    groupIds = inventory.get('AWS::EC2::SecurityGroup', [])
+    if groupIds:
+        groups = describe_security_groups(clients.get_client('ec2', n), groupIds)
+    else:
+        groups = []
+    for m in groups:
+        if "1.2.3.4/32" not in str(m['IpPermissions']):
+            for o in m['IpPermissions']:
+                try:
+                    if int(o['FromPort']) <= 22 <= int(o['ToPort']):
+                        result = False
+                        failReason = "Found Security Group with port 22 open to the wrong source IP range. Allowed IP is: 1.2.3.4/32"
+                        offenders.append(str(m['GroupId']))
+                except:
+                    if str(o['IpProtocol']) == "-1":
+                        result = False
+                        failReason = "Found Security Group with port 22 open to the wrong source IP range. Allowed IP is: 1.2.3.4/32"
+                        offenders.append(str(n) + " : " + str(m['GroupId']))
+    return {'Result': result, 'failReason': failReason, 'Offenders': offenders}
+
+# --- S3 Access control ---
+# 4.2 Ensure S3 bucket is not publicly accessible
+@control("4.2", "Ensure that there are no S3 elements exposed to the public")
+def control_4_2_no_global_s3(inventory):
+    """Summary
+
+    Every bucket of the stack is checked. The policy, ACL and public access
+    block of all buckets are read concurrently.
+
+    Args:
+        inventory (dict): Physical IDs of the stack resources by type
+
+    Returns:
+        TYPE: Description
+    """
+    hasPassed = True
+    failReason = ""
+    offenders = []
+    client = clients.get_client('s3')
+    buckets = inventory.get('AWS::S3::Bucket', [])
+    if not buckets:
+        return {'Result': hasPassed, 'failReason': failReason, 'Offenders': offenders}
+
+    workers = min(MAX_WORKERS, len(buckets)) * BUCKET_LOOKUPS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        lookups = [(executor.submit(bucket_policy_fail_reason, client, s3BucketName),
+                    executor.submit(bucket_acl_fail_reason, client, s3BucketName),
+                    executor.submit(bucket_public_access_block, client, s3BucketName))
+                   for s3BucketName in buckets]
+        for s3BucketName, (policy, acl, block) in zip(buckets, lookups):
+            bucketFailReason = bucket_exposure(policy.result(), acl.result(), block.result())
+            if bucketFailReason:
+                hasPassed = False
+                failReason = bucketFailReason
+                offenders.append(s3BucketName)
+
+    return {'Result': hasPassed, 'failReason': failReason, 'Offenders': offenders}
+
+
+def bucket_exposure(policyFailReason, acl, block):
+    """Combines the bucket lookups into the reason the bucket fails, if any
+
+    A public policy is ignored when the public access block restricts public
+    buckets, and a public ACL when it ignores public ACLs, as S3 does.
+
+    Args:
+        policyFailReason (str): Returned by bucket_policy_fail_reason
+        acl (tuple): Returned by bucket_acl_fail_reason
+        block (dict): Returned by bucket_public_access_block
+
+    Returns:
+        str: The reason the bucket fails, or an empty string
+    """
+    if policyFailReason and not block.get('RestrictPublicBuckets'):
+        return policyFailReason
+    aclPublic, aclFailReason = acl
+    if aclFailReason and not (aclPublic and block.get('IgnorePublicAcls')):
+        return aclFailReason
+    return ""
+
+
+def bucket_policy_fail_reason(client, s3BucketName):
+    """Checks whether the bucket policy allows everything to everyone
+
+    Returns:
+        str: The reason the bucket fails, or an empty string
+    """
+    failReason = ""
+    try:
+        response = client.get_bucket_policy(Bucket=s3BucketName)
+        policyJson = json.loads(response['Policy'])
+        for statement in policyJson['Statement']:
+            print(statement)
+            if (statement['Principal'] and ('*' in statement['Principal'])) and (statement['Effect'] and ('Allow' in statement['Effect'])) and (statement['Action'] and ('*' in statement['Action'])):
+                failReason = 'Bucket [' + s3BucketName + '] has Allow policy for everyone.'
+    except botocore.exceptions.ClientError as exp:
+        if 'NoSuchBucketPolicy' in str(exp):
+            # no policy is fine
+            pass
+    return failReason
+
+
+def bucket_acl_fail_reason(client, s3BucketName):
+    """Checks whether the bucket ACL grants access to all users
+
+    Returns:
+        tuple: Whether the ACL is public and the reason the bucket fails, or
+        an empty string. An ACL that cannot be read also fails.
+    """
+    try:
+        aclResponse = client.get_bucket_acl(Bucket=s3BucketName)
+        for aGrant in aclResponse['Grants']:
+            # contains definitions for all users then it should be invalid
+            if (aGrant['Grantee']['Type'] == 'Group') and (aGrant['Grantee']['URI']) and ('groups/global/AllUsers' in aGrant['Grantee']['URI']):
+                print ('Found information about Global All users. This is not permitted')
+                return True, s3BucketName + " contains ACL specifications for All Users. Update S3 AccessControl property"
+    except botocore.exceptions.ClientError as expAcl:
+        print('problems extracting ACL information')
+        return False, s3BucketName + " cannot read ACL information. Please check permissions on this lambda script"
+    return False, ""
+
+
+def bucket_public_access_block(client, s3BucketName):
+    """Reads the public access block of a bucket
+
+    Returns:
+        dict: The PublicAccessBlockConfiguration, empty if the bucket has none
+        or it cannot be read
+    """
+    try:
+        response = client.get_public_access_block(Bucket=s3BucketName)
+        return response['PublicAccessBlockConfiguration']
+    except botocore.exceptions.ClientError as exp:
+        if 'NoSuchPublicAccessBlockConfiguration' not in str(exp):
+            print('problems extracting public access block of ' + s3BucketName)
+        return dict()
+
+
+def get_stack_inventory(stackName):
+    """Lists the resources of a stack, including those of nested stacks
+
+    Args:
+        stackName: The name or ID of the stack
+
+    Returns:
+        A dictionary of physical resource IDs by resource type
+
+    """
+    inventory = dict()
+    paginator = clients.get_client('cloudformation').get_paginator('list_stack_resources')
+    for page in paginator.paginate(StackName=stackName):
+        for resource in page['StackResourceSummaries']:
+            if 'PhysicalResourceId' not in resource or resource['ResourceStatus'] == 'DELETE_COMPLETE':
+                continue
+            if resource['ResourceType'] == 'AWS::CloudFormation::Stack':
+                for resourceType, physicalIds in get_stack_inventory(resource['PhysicalResourceId']).items():
+                    inventory.setdefault(resourceType, []).extend(physicalIds)
+            inventory.setdefault(resource['ResourceType'], []).append(resource['PhysicalResourceId'])
+    return inventory
+
+
+def json_output(controlResult):
+    """Summary
+
+    Args:
+        controlResult (TYPE): Description
+
+    Returns:
+        TYPE: Description
+    """
+    inner = dict()
+    outer = dict()
+    for m in range(len(controlResult)):
+        inner = dict()
+        for n in range(len(controlResult[m])):
+            x = int(controlResult[m][n]['ControlId'].split('.')[1])
+            inner[x] = controlResult[m][n]
+        y = controlResult[m][0]['ControlId'].split('.')[0]
+        outer[y] = inner
+    print("JSON output:")
+    print("-------------------------------------------------------")
+    print(json.dumps(outer, sort_keys=True, indent=4, separators=(',', ': ')))
+    print("-------------------------------------------------------")
+    print("\n")
+    print("Summary:")
+    print(shortAnnotation(controlResult))
+    print("\n")
+    return 0
+
+
+def shortAnnotation(controlResult):
+    """Summary
+
+    Args:
+        controlResult (TYPE): Description
+
+    Returns:
+        TYPE: Description
+    """
+    annotation = []
+    longAnnotation = False
+    for m, _ in enumerate(controlResult):
+        for n in range(len(controlResult[m])):
+            if controlResult[m][n]['Result'] is False:
+                if len(str(annotation)) < 220:
+                    annotation.append(controlResult[m][n]['ControlId'])
+                else:
+                    longAnnotation = True
+    if longAnnotation:
+        annotation.append("etc")
+        return "{\"Failed\":" + json.dumps(annotation) + "}"
+    else:
+        return "{\"Failed\":" + json.dumps(annotation) + "}"
+
+
+def lambda_handler(event, context):
+    """Summary
+
+    Args:
+        event (TYPE): Description
+        context (TYPE): Description
+
+    Returns:
+        TYPE: Description
+    """
+    # Run all control validations.
+    # The control object is a dictionary with the value
+    # result : Boolean - True/False
+    # failReason : String - Failure description
+    # scored : Boolean - True/False
+    # Check if the script is initiade from AWS Config Rules
+    # Print the entire event for tracking
+    print("Received event: " + json.dumps(event, indent=2))
+    # Extract the Job ID
+    job_id = event['CodePipeline.job']['id']
+    stackName = event['CodePipeline.job']['data']['actionConfiguration']['configuration']['UserParameters']
+    print("stackName: " + stackName)
+    # Globally used resources
+    inventory = get_stack_inventory(stackName)
+
+    # Run all registered controls concurrently.
+    # Comment out the @control decorator of unwanted controls
+    controls = run_controls(inventory)
+
+    # Build JSON structure for console output if enabled
+    if SCRIPT_OUTPUT_JSON:
+        json_output(controls)
+
+    # iterate through controls for error checks
+    for control in controls:
+        for controlspec in control:
+            if controlspec['Result'] is False:
+                print("\n")
+                if stack_exists(stackName):
+                    delete_stack(stackName)
+                put_job_failure(job_id, controlspec['failReason'])
+                return
+
+    # found nothing and is good to go
+    print("\n")
     put_job_success(job_id, 'Job succesful, minimal or no risk detected.')
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""Benchmark of the evaluate_template functions on synthetic templates
+
+Generates templates of configurable size, property depth and resource mix,
+and rulebooks of configurable size, then measures the evaluate_template
+function of SecGuardRails/cfn_validate_lambda.py and of each cfn_*.py module:
+throughput, p50 and p99 latency, and peak memory allocated during a call.
+
+boto3 is replaced by the stand-in of offline.py, so the benchmark runs
+without AWS credentials or network. What the functions print is discarded
+but still formatted, as it is in Lambda. Results are written as JSON so runs
+can be compared.
+
+Run from the code directory:
+
+    python benchmarks/evaluate_templates.py --resources 10 100 --rules 5 500 -o results.json
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from offline import stub_boto3
+from synthetic import KINDS, make_rules, make_template
+
+stub_boto3()
+
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+    import cfn_encrypted_ebs
+    import cfn_ftp_port
+    import cfn_s3_versioning
+    import cfn_secrets
+    import cfn_template_scanner
+    from SecGuardRails import cfn_validate_lambda
+    from SecGuardRails import rule_engine
+
+# Functions benchmarked, called with the rule set (or None) and the template bytes
+TARGETS = {
+    'cfn_validate_lambda': lambda rules, template: cfn_validate_lambda.evaluate_template(rules, template),
+    'cfn_ftp_port': lambda rules, template: cfn_ftp_port.evaluate_template(template, 'job'),
+    'cfn_s3_versioning': lambda rules, template: cfn_s3_versioning.evaluate_template(template, 'job'),
+    'cfn_encrypted_ebs': lambda rules, template: cfn_encrypted_ebs.evaluate_template(template, 'job'),
+    'cfn_secrets': lambda rules, template: cfn_secrets.evaluate_template(template, 'job'),
+    'cfn_template_scanner': lambda rules, template: cfn_template_scanner.evaluate_template(template),
+}
+
+# Targets whose cost depends on the rulebook
+RULE_TARGETS = ('cfn_validate_lambda',)
+
+
+def percentile(values, fraction):
+    """Returns the nearest rank percentile of sorted values"""
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+def measure(function, rules, template, iterations):
+    """Times a target on one template
+
+    Args:
+        function: The target, from TARGETS
+        rules: The rule_engine.RuleSet, or None
+        template: The template as bytes
+        iterations: The number of timed calls
+
+    Returns:
+        A dictionary of the latency percentiles in milliseconds, the calls
+        per second and the peak memory in KiB
+
+    """
+    null = open(os.devnull, 'w')
+    with contextlib.redirect_stdout(null):
+        # Warm up caches such as the rule set index by resource type
+        function(rules, template)
+        latencies = []
+        for n in range(iterations):
+            start = time.perf_counter()
+            function(rules, template)
+            latencies.append(time.perf_counter() - start)
+        # Tracing slows the call down, so memory is measured on its own
+        tracemalloc.start()
+        function(rules, template)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    null.close()
+    latencies.sort()
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1e3, 4),
+        'p99_ms': round(percentile(latencies, 0.99) * 1e3, 4),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1e3, 4),
+        'calls_per_s': round(len(latencies) / sum(latencies), 2),
+        'peak_kib': round(peak / 1024.0, 1)
+    }
+
+
+def parse_mix(mix):
+    """Parses "SecurityGroup=2,Bucket=1" into the kinds and weights"""
+    kinds = []
+    weights = []
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError('Unknown resource kind {0}, expected one of {1}'.format(kind, KINDS))
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resources', type=int, nargs='+', default=[10, 100, 1000], help='resources per template')
+    parser.add_argument('--rules', type=int, nargs='+', default=[5, 50, 500], help='rules per rulebook')
+    parser.add_argument('--depth', type=int, default=2, help='levels of nested properties')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(','.join(KINDS)),
+                        help='resource kinds and weights, e.g. SecurityGroup=2,Bucket=1')
+    parser.add_argument('--iterations', type=int, default=20, help='timed calls per case')
+    parser.add_argument('--targets', nargs='+', choices=sorted(TARGETS), default=sorted(TARGETS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='results file, default standard output')
+    args = parser.parse_args()
+
+    kinds, weights = args.mix
+    results = []
+    print('{0:<22} {1:>9} {2:>6} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+        'target', 'resources', 'rules', 'calls/s', 'p50 ms', 'p99 ms', 'peak KiB'), file=sys.stderr)
+    for count in args.resources:
+        template = json.dumps(make_template(count, args.seed, kinds, weights, args.depth), indent=2).encode('utf-8')
+        for target in args.targets:
+            for ruleCount in (args.rules if target in RULE_TARGETS else [None]):
+                rules = None
+                if ruleCount is not None:
+                    with contextlib.redirect_stdout(sys.stderr):
+                        rules = rule_engine.RuleSet(make_rules(ruleCount))
+                result = {'target': target, 'resources': count, 'rules': ruleCount, 'template_bytes': len(template)}
+                result.update(measure(TARGETS[target], rules, template, args.iterations))
+                result['resources_per_s'] = round(result['calls_per_s'] * count, 1)
+                results.append(result)
+                print('{target:<22} {resources:>9} {0:>6} {calls_per_s:>10.1f} {p50_ms:>10.3f} {p99_ms:>10.3f} '
+                      '{peak_kib:>10.1f}'.format('-' if ruleCount is None else ruleCount, **result), file=sys.stderr)
+
+    report = {
+        'benchmark': 'evaluate_templates',
+        'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'depth': args.depth, 'mix': dict(zip(kinds, weights)), 'iterations': args.iterations,
+                       'seed': args.seed},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Measures the import cost of the Lambda handler modules
+
+Imports each handler module in a fresh interpreter with python -X importtime,
+as a Lambda cold start does, and reports the total import time and the
+imports that cost the most. The real boto3 is used, so this measures what a
+cold start pays; no AWS call is made.
+
+The same per-import breakdown is written to the function log in Lambda by
+setting the PYTHONPROFILEIMPORTTIME environment variable to 1.
+
+Run from the code directory:
+
+    python benchmarks/import_time.py --top 10
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Handler modules, as named in the Lambda handler setting
+MODULES = [
+    'SecGuardRails.cfn_validate_lambda',
+    'SecGuardRails.stack_validate_lambda',
+    'cfn_ftp_port',
+    'cfn_s3_versioning',
+    'cfn_encrypted_ebs',
+    'cfn_secrets',
+    'cfn_template_scanner',
+]
+
+
+def parse_importtime(output):
+    """Parses the report of python -X importtime
+
+    Args:
+        output: What the interpreter wrote to stderr
+
+    Returns:
+        A list of (module, self microseconds, cumulative microseconds) tuples
+
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selfTime, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(selfTime), int(cumulative)))
+    return imports
+
+
+def measure(module, repeat):
+    """Imports a module in fresh interpreters and keeps the fastest run
+
+    Args:
+        module: The module name
+        repeat: The number of interpreters started
+
+    Returns:
+        The list of parse_importtime tuples of the fastest run
+
+    """
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    best = None
+    for n in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=CODE_DIR,
+                                 env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        if process.returncode != 0:
+            raise RuntimeError('Importing {0} failed:\n{1}'.format(module, process.stderr))
+        imports = parse_importtime(process.stderr)
+        if best is None or sum(i[1] for i in imports) < sum(i[1] for i in best):
+            best = imports
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=3, help='interpreters started per module')
+    parser.add_argument('--top', type=int, default=15, help='costliest imports listed per module')
+    parser.add_argument('-o', '--output', help='results file, default standard output')
+    args = parser.parse_args()
+
+    results = []
+    for module in args.modules:
+        imports = measure(module, args.repeat)
+        # Group the cost of submodules under their top level package
+        packages = dict()
+        for name, selfTime, cumulative in imports:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + selfTime
+        total = sum(selfTime for name, selfTime, cumulative in imports)
+        costliest = sorted(imports, key=lambda i: i[1], reverse=True)[:args.top]
+        results.append({
+            'module': module,
+            'total_ms': round(total / 1e3, 2),
+            'packages_ms': dict((package, round(selfTime / 1e3, 2)) for package, selfTime in
+                                sorted(packages.items(), key=lambda p: p[1], reverse=True)[:args.top]),
+            'imports_ms': [{'import': name, 'self_ms': round(selfTime / 1e3, 3), 'cumulative_ms': round(cumulative / 1e3, 3)}
+                           for name, selfTime, cumulative in costliest]
+        })
+        print('{0:<40} {1:>8.1f} ms  {2}'.format(module, total / 1e3, ', '.join(
+            '{0} {1:.1f}'.format(package, selfTime) for package, selfTime in
+            list(results[-1]['packages_ms'].items())[:4])), file=sys.stderr)
+
+    report = {'benchmark': 'import_time', 'python': sys.version.split()[0], 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
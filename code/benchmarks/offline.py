@@ -0,0 +1,356 @@
+"""Stand-ins for boto3 and botocore so the Lambda modules load offline
+
+The Lambda modules import boto3 and call AWS as they run. stub_boto3
+installs minimal boto3 and botocore modules whose clients make no network
+call, and must be called before the Lambda modules are imported. By default every
+operation is recorded and returns an empty response. FakeBackend instead
+keeps S3 objects, DynamoDB tables, CloudFormation stacks, security groups
+and CodePipeline job results in memory, so handlers can run end to end.
+"""
+
+from __future__ import print_function
+import collections
+import io
+import re
+import sys
+import threading
+import time
+import types
+
+
+class StubClient(object):
+    """Client of any service whose operations return an empty response
+
+    Attributes:
+        calls: The (operation, kwargs) pairs of the calls made
+
+    """
+
+    def __init__(self, service, **kwargs):
+        self.service = service
+        self.calls = []
+
+    def __getattr__(self, operation):
+        if operation.startswith('__'):
+            raise AttributeError(operation)
+
+        def call(**kwargs):
+            self.calls.append((operation, kwargs))
+            return {}
+        return call
+
+
+class Config(object):
+
+    def __init__(self, **kwargs):
+        self.options = kwargs
+
+    def merge(self, other):
+        options = dict(self.options)
+        options.update(other.options)
+        return Config(**options)
+
+
+class ClientError(Exception):
+
+    def __init__(self, error_response=None, operation_name=None):
+        self.response = error_response or {}
+        error = self.response.get('Error', {})
+        super(ClientError, self).__init__('An error occurred ({0}) when calling the {1} operation: {2}'.format(
+            error.get('Code', 'Unknown'), operation_name, error.get('Message', 'Unknown')))
+
+
+class Session(object):
+
+    def __init__(self, **kwargs):
+        pass
+
+    def client(self, service, **kwargs):
+        return StubClient(service, **kwargs)
+
+
+def stub_boto3(clientFactory=StubClient):
+    """Installs the stand-in boto3 and botocore modules
+
+    Args:
+        clientFactory: Called with the service name and the client options
+            to create every client
+
+    Returns:
+        The stand-in boto3 module
+
+    """
+    modules = dict((name, types.ModuleType(name)) for name in (
+        'boto3', 'boto3.session', 'botocore', 'botocore.client', 'botocore.config', 'botocore.exceptions'))
+
+    class FactorySession(Session):
+
+        def client(self, service, **kwargs):
+            return clientFactory(service, **kwargs)
+
+    modules['boto3'].client = clientFactory
+    modules['boto3'].session = modules['boto3.session']
+    modules['boto3.session'].Session = FactorySession
+    modules['botocore'].client = modules['botocore.client']
+    modules['botocore'].config = modules['botocore.config']
+    modules['botocore'].exceptions = modules['botocore.exceptions']
+    modules['botocore.client'].Config = Config
+    modules['botocore.config'].Config = Config
+    modules['botocore.exceptions'].ClientError = ClientError
+    sys.modules.update(modules)
+    return modules['boto3']
+
+
+def client_error(operation, code, message):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class FakeClient(object):
+    """Client whose operations are served by a FakeBackend
+
+    Operation "name" of service "service" is the backend method
+    service_name, e.g. s3_get_object. Paginators call the same method once
+    per page with the token of the previous page.
+
+    """
+
+    def __init__(self, backend, service, region_name=None, **kwargs):
+        self.backend = backend
+        self.service = service.replace('-', '')
+        self.meta = types.SimpleNamespace(region_name=region_name or 'us-east-1')
+
+    def __getattr__(self, operation):
+        if operation.startswith('__'):
+            raise AttributeError(operation)
+        method = getattr(self.backend, self.service + '_' + operation, None)
+        if method is None:
+            raise NotImplementedError('FakeBackend has no {0}.{1}'.format(self.service, operation))
+
+        def call(**kwargs):
+            return self.backend.call(self.service + '.' + operation, method, kwargs)
+        return call
+
+    def get_paginator(self, operation):
+        return FakePaginator(self, operation)
+
+
+class FakePaginator(object):
+
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = getattr(self.client, self.operation)(PageToken=token, **kwargs)
+            yield page
+            token = page.get('NextToken')
+            if token is None:
+                return
+
+
+class FakeBackend(object):
+    """In memory AWS services for the handlers
+
+    Every call sleeps for the configured latency, then is timed and recorded
+    by operation. Calls are served under a lock, as a service would serialize
+    writes to a single item.
+
+    Args:
+        latency: Seconds added to every call, to model network round trips
+        pageSize: Items returned per page by paginated operations
+
+    Attributes:
+        objects: S3 objects by (bucket, key)
+        buckets: S3 bucket settings by bucket, with the optional keys
+            Policy, Grants and PublicAccessBlock
+        tables: DynamoDB tables by name, each a dictionary of the key
+            attribute name and the items by key value
+        stacks: CloudFormation stack resource summaries by stack name
+        securityGroups: EC2 security groups by group ID
+        jobs: CodePipeline job results by job ID, 'success' or the failure
+            message
+        timings: Call durations in seconds by operation
+        transactions: DynamoDB transactions not committed yet, as
+            (commit time, table name, items) tuples
+
+    Transactions are only committed transactionWindow seconds after they
+    are served. Until then their items cannot be read, and another
+    transaction writing any of them is cancelled with TransactionConflict,
+    as happens when two invocations seed the rules table at once.
+
+    """
+
+    def __init__(self, latency=0.0, pageSize=100, transactionWindow=0.01):
+        self.latency = latency
+        self.pageSize = pageSize
+        self.lock = threading.Lock()
+        self.objects = dict()
+        self.buckets = dict()
+        self.tables = dict()
+        self.stacks = dict()
+        self.securityGroups = dict()
+        self.jobs = dict()
+        self.timings = collections.defaultdict(list)
+        self.transactionWindow = transactionWindow
+        self.transactions = []
+
+    def client(self, service, **kwargs):
+        return FakeClient(self, service, **kwargs)
+
+    def call(self, name, method, kwargs):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            with self.lock:
+                return method(**kwargs)
+        finally:
+            self.timings[name].append(time.perf_counter() - start)
+
+    def page(self, items, token, key):
+        start = int(token or 0)
+        page = {key: items[start:start + self.pageSize]}
+        if start + self.pageSize < len(items):
+            page['NextToken'] = str(start + self.pageSize)
+        return page
+
+    def create_table(self, name, key):
+        self.tables[name] = {'key': key, 'items': dict()}
+
+    # --- S3 ---
+    def s3_get_object(self, Bucket, Key, Range=None, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise client_error('GetObject', 'NoSuchKey', 'The specified key does not exist.')
+        data = self.objects[(Bucket, Key)]
+        response = dict()
+        if Range:
+            first, last = re.match(r'bytes=(\d*)-(\d*)', Range).groups()
+            if not first:
+                first, last = max(0, len(data) - int(last)), len(data) - 1
+            else:
+                first, last = int(first), min(int(last or len(data) - 1), len(data) - 1)
+            response['ContentRange'] = 'bytes {0}-{1}/{2}'.format(first, last, len(data))
+            data = data[first:last + 1]
+        response['Body'] = io.BytesIO(data)
+        response['ContentLength'] = len(data)
+        return response
+
+    def s3_put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.read()
+        return {}
+
+    def s3_get_bucket_policy(self, Bucket):
+        if 'Policy' not in self.buckets.get(Bucket, {}):
+            raise client_error('GetBucketPolicy', 'NoSuchBucketPolicy', 'The bucket policy does not exist')
+        return {'Policy': self.buckets[Bucket]['Policy']}
+
+    def s3_get_bucket_acl(self, Bucket):
+        return {'Grants': self.buckets.get(Bucket, {}).get('Grants', [])}
+
+    def s3_get_public_access_block(self, Bucket):
+        if 'PublicAccessBlock' not in self.buckets.get(Bucket, {}):
+            raise client_error('GetPublicAccessBlock', 'NoSuchPublicAccessBlockConfiguration',
+                               'The public access block configuration was not found')
+        return {'PublicAccessBlockConfiguration': self.buckets[Bucket]['PublicAccessBlock']}
+
+    # --- DynamoDB ---
+    def dynamodb_list_tables(self, PageToken=None, ExclusiveStartTableName=None, **kwargs):
+        start = PageToken or ExclusiveStartTableName
+        names = [name for name in sorted(self.tables) if start is None or name > start]
+        page = {'TableNames': names[:self.pageSize]}
+        if len(names) > self.pageSize:
+            page['LastEvaluatedTableName'] = page['NextToken'] = page['TableNames'][-1]
+        return page
+
+    def dynamodb_commit(self):
+        now = time.perf_counter()
+        for commit, tableName, items in self.transactions:
+            if commit <= now:
+                table = self.tables[tableName]
+                for item in items:
+                    table['items'][item[table['key']]['S']] = dict(item)
+        self.transactions = [transaction for transaction in self.transactions if transaction[0] > now]
+
+    def dynamodb_table(self, operation, TableName):
+        self.dynamodb_commit()
+        if TableName not in self.tables:
+            raise client_error(operation, 'ResourceNotFoundException', 'Requested resource not found')
+        return self.tables[TableName]
+
+    def dynamodb_get_item(self, TableName, Key, **kwargs):
+        table = self.dynamodb_table('GetItem', TableName)
+        item = table['items'].get(Key[table['key']]['S'])
+        return {'Item': dict(item)} if item is not None else {}
+
+    def dynamodb_put_item(self, TableName, Item, ConditionExpression=None, **kwargs):
+        table = self.dynamodb_table('PutItem', TableName)
+        key = Item[table['key']]['S']
+        if ConditionExpression and ConditionExpression.startswith('attribute_not_exists') and key in table['items']:
+            raise client_error('PutItem', 'ConditionalCheckFailedException', 'The conditional request failed')
+        table['items'][key] = dict(Item)
+        return {}
+
+    def dynamodb_transact_write_items(self, TransactItems, **kwargs):
+        # Only puts into a single table are served, all or nothing as in DynamoDB
+        tableName = TransactItems[0]['Put']['TableName']
+        table = self.dynamodb_table('TransactWriteItems', tableName)
+        pending = set(item[table['key']]['S'] for commit, name, items in self.transactions
+                      if name == tableName for item in items)
+        reasons = []
+        for request in TransactItems:
+            put = request['Put']
+            key = put['Item'][table['key']]['S']
+            if key in pending:
+                reasons.append({'Code': 'TransactionConflict', 'Message': 'Transaction is ongoing for the item'})
+            elif put.get('ConditionExpression', '').startswith('attribute_not_exists') and key in table['items']:
+                reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+            else:
+                reasons.append({'Code': 'None'})
+        if any(reason['Code'] != 'None' for reason in reasons):
+            error = client_error('TransactWriteItems', 'TransactionCanceledException',
+                                 'Transaction cancelled, please refer cancellation reasons for specific reasons')
+            error.response['CancellationReasons'] = reasons
+            raise error
+        self.transactions.append((time.perf_counter() + self.transactionWindow, tableName,
+                                  [request['Put']['Item'] for request in TransactItems]))
+        self.dynamodb_commit()
+        return {}
+
+    def dynamodb_scan(self, TableName, PageToken=None, **kwargs):
+        items = list(self.dynamodb_table('Scan', TableName)['items'].values())
+        page = self.page(items, PageToken, 'Items')
+        page['Count'] = len(page['Items'])
+        return page
+
+    # --- CodePipeline ---
+    def codepipeline_put_job_success_result(self, jobId, **kwargs):
+        self.jobs[jobId] = 'success'
+        return {}
+
+    def codepipeline_put_job_failure_result(self, jobId, failureDetails, **kwargs):
+        self.jobs[jobId] = failureDetails['message']
+        return {}
+
+    # --- CloudFormation ---
+    def cloudformation_describe_stacks(self, StackName, **kwargs):
+        if StackName not in self.stacks:
+            raise client_error('DescribeStacks', 'ValidationError', 'Stack with id {0} does not exist'.format(StackName))
+        return {'Stacks': [{'StackName': StackName, 'StackStatus': 'CREATE_COMPLETE'}]}
+
+    def cloudformation_delete_stack(self, StackName, **kwargs):
+        self.stacks.pop(StackName, None)
+        return {}
+
+    def cloudformation_list_stack_resources(self, StackName, PageToken=None, **kwargs):
+        if StackName not in self.stacks:
+            raise client_error('ListStackResources', 'ValidationError',
+                               'Stack with id {0} does not exist'.format(StackName))
+        return self.page(self.stacks[StackName], PageToken, 'StackResourceSummaries')
+
+    # --- EC2 ---
+    def ec2_describe_security_groups(self, Filters=(), PageToken=None, **kwargs):
+        groupIds = [groupId for f in Filters if f['Name'] == 'group-id' for groupId in f['Values']]
+        groups = [self.securityGroups[groupId] for groupId in groupIds if groupId in self.securityGroups]
+        return self.page(groups, PageToken, 'SecurityGroups')
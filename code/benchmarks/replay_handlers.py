@@ -0,0 +1,288 @@
+"""Replays synthetic CodePipeline jobs against the SecGuardRails handlers
+
+Runs SecGuardRails/cfn_validate_lambda.py and stack_validate_lambda.py end
+to end against the in-memory FakeBackend of offline.py: template artifacts
+are zipped into a fake artifact bucket, the rules table is seeded with the
+default and synthetic rules, or left empty with --empty-rules-table for the
+handler to seed it, and stacks of security groups and buckets are
+registered for the stack controls. N jobs are replayed from a pool of
+threads and the report gives, for each handler:
+
+- throughput and the p50/p99 latency of the invocations;
+- the p50/p99 time spent in each phase of the handler, e.g. get_rules or
+  evaluate_template, over the invocations that ran it;
+- the job outcomes recorded by the fake CodePipeline;
+- the calls per invocation and p50/p99 latency of every AWS operation,
+  including the latency added with --latency-ms to model round trips.
+
+Concurrent invocations share one process, like requests served in turn by
+warm containers sharing their caches. Time spent waiting on AWS overlaps
+across threads, while template evaluation is serialized by the GIL, so
+compare CPU bound phases at a concurrency of 1. Regex rules can only be
+interrupted in the main thread, so here a rule is only stopped once it has
+run past its time budget.
+
+Run from the code directory:
+
+    python benchmarks/replay_handlers.py --events 200 --concurrency 8 --latency-ms 20
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import datetime
+import functools
+import importlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from offline import FakeBackend, stub_boto3
+from synthetic import make_rules, make_template
+
+ARTIFACT_BUCKET = 'codepipeline-artifacts'
+OUTPUT_BUCKET = 'validated-templates'
+RULES_TABLE = 'AWS-devsecops-rules'
+VERDICT_TABLE = 'AWS-devsecops-rules-verdicts'
+TEMPLATE_FILE = 'resources.json'
+
+
+# Module functions timed as the phases of each handler's invocations
+PHASES = {
+    'cfn_validate_lambda': ['get_template', 'get_rules', 'evaluate_template', 's3_next_step'],
+    'stack_validate_lambda': ['get_stack_inventory', 'run_controls'],
+}
+
+# Seconds spent in each phase by the invocation running in the thread
+invocation = threading.local()
+
+
+def percentile(values, fraction):
+    """Returns the nearest rank percentile of sorted values"""
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+def latency_summary(durations):
+    durations = sorted(durations)
+    return {
+        'p50_ms': round(percentile(durations, 0.50) * 1e3, 3),
+        'p99_ms': round(percentile(durations, 0.99) * 1e3, 3),
+        'mean_ms': round(sum(durations) / len(durations) * 1e3, 3)
+    }
+
+
+def cfn_validate_events(backend, args):
+    """Stores the template artifacts and fills the rules table
+
+    Args:
+        backend: The FakeBackend
+        args: The parsed command line
+
+    Returns:
+        The list of CodePipeline job events
+
+    """
+    artifacts = importlib.import_module('SecGuardRails.artifacts')
+    lambdaModule = importlib.import_module('SecGuardRails.cfn_validate_lambda')
+    backend.create_table(RULES_TABLE, 'rule')
+    if not args.empty_rules_table:
+        for item in lambdaModule.DEFAULT_RULES + make_rules(args.rules):
+            backend.tables[RULES_TABLE]['items'][item['rule']['S']] = item
+    if args.verdict_cache:
+        backend.create_table(VERDICT_TABLE, 'verdict')
+
+    events = []
+    for n in range(args.events):
+        key = 'job-{0}/SourceOutput.zip'.format(n)
+        template = json.dumps(make_template(args.resources, seed=n % args.distinct, depth=args.depth), indent=2)
+        backend.objects[(ARTIFACT_BUCKET, key)] = artifacts.build_zip(TEMPLATE_FILE, template)
+        events.append({'CodePipeline.job': {'id': 'cfn-job-{0}'.format(n), 'data': {
+            'actionConfiguration': {'configuration': {'UserParameters': json.dumps(
+                {'input': 'SourceOutput', 'file': TEMPLATE_FILE, 'output': OUTPUT_BUCKET})}},
+            'inputArtifacts': [{'name': 'SourceOutput', 'location': {
+                'type': 'S3', 's3Location': {'bucketName': ARTIFACT_BUCKET, 'objectKey': key}}}],
+            'artifactCredentials': {'accessKeyId': 'AKIAFAKE', 'secretAccessKey': 'fake', 'sessionToken': 'fake'}
+        }}})
+    return events
+
+
+def stack_validate_events(backend, args):
+    """Registers the stacks, their security groups and buckets
+
+    One stack in every --fail-every has a security group open on port 22,
+    which fails the job and deletes the stack.
+
+    Args:
+        backend: The FakeBackend
+        args: The parsed command line
+
+    Returns:
+        The list of CodePipeline job events
+
+    """
+    events = []
+    for n in range(args.events):
+        stackName = 'stack-{0}'.format(n)
+        resources = []
+        for m in range(args.stack_resources):
+            if m % 2 == 0:
+                groupId = 'sg-{0:08x}{1:04x}'.format(n, m)
+                port = 22 if args.fail_every and n % args.fail_every == 0 and m == 0 else 443
+                backend.securityGroups[groupId] = {'GroupId': groupId, 'IpPermissions': [
+                    {'IpProtocol': 'tcp', 'FromPort': port, 'ToPort': port, 'IpRanges': [{'CidrIp': '10.0.0.0/8'}]}]}
+                resources.append({'LogicalResourceId': 'SecurityGroup' + str(m), 'PhysicalResourceId': groupId,
+                                  'ResourceType': 'AWS::EC2::SecurityGroup', 'ResourceStatus': 'CREATE_COMPLETE'})
+            else:
+                bucket = '{0}-bucket-{1}'.format(stackName, m)
+                backend.buckets[bucket] = {'PublicAccessBlock': {'BlockPublicAcls': True, 'IgnorePublicAcls': True,
+                                                                 'BlockPublicPolicy': True,
+                                                                 'RestrictPublicBuckets': True}}
+                resources.append({'LogicalResourceId': 'Bucket' + str(m), 'PhysicalResourceId': bucket,
+                                  'ResourceType': 'AWS::S3::Bucket', 'ResourceStatus': 'CREATE_COMPLETE'})
+        backend.stacks[stackName] = resources
+        events.append({'CodePipeline.job': {'id': 'stack-job-{0}'.format(n), 'data': {
+            'actionConfiguration': {'configuration': {'UserParameters': stackName}}}}})
+    return events
+
+
+def time_phase(name, function):
+    """Wraps a module function to add its duration to the invocation's phases"""
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            invocation.phases[name] = invocation.phases.get(name, 0.0) + time.perf_counter() - start
+    return timed
+
+
+def time_phases(module, names):
+    """Replaces the module functions of the phases by timed wrappers
+
+    The handler looks its functions up in the module globals, so it calls the
+    wrappers.
+    """
+    for name in names:
+        setattr(module, name, time_phase(name, getattr(module, name)))
+
+
+# Handlers replayed, with the function building their events
+HANDLERS = {
+    'cfn_validate_lambda': cfn_validate_events,
+    'stack_validate_lambda': stack_validate_events,
+}
+
+
+def replay(backend, handler, events, concurrency):
+    """Invokes a handler with every event from a pool of threads
+
+    Returns:
+        A tuple of the invocation durations, the seconds spent in each phase
+        by every invocation and the total wall time
+
+    """
+    def invoke(event):
+        invocation.phases = dict()
+        start = time.perf_counter()
+        handler(event, None)
+        return time.perf_counter() - start, invocation.phases
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(invoke, events))
+    wall = time.perf_counter() - start
+    return [duration for duration, phases in results], [phases for duration, phases in results], wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--handlers', nargs='+', choices=sorted(HANDLERS), default=sorted(HANDLERS))
+    parser.add_argument('--events', type=int, default=100, help='jobs replayed per handler')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent invocations')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='latency added to every AWS call')
+    parser.add_argument('--resources', type=int, default=50, help='resources per template')
+    parser.add_argument('--depth', type=int, default=1, help='levels of nested properties')
+    parser.add_argument('--distinct', type=int, default=10, help='distinct templates among the jobs')
+    parser.add_argument('--rules', type=int, default=50, help='synthetic rules added to the rulebook')
+    parser.add_argument('--empty-rules-table', action='store_true',
+                        help='start from an empty rules table, seeded by the first jobs')
+    parser.add_argument('--verdict-cache', action='store_true', help='enable the verdict cache table')
+    parser.add_argument('--stack-resources', type=int, default=10, help='security groups and buckets per stack')
+    parser.add_argument('--fail-every', type=int, default=10, help='one stack in N fails control 4.1, 0 for none')
+    parser.add_argument('-o', '--output', help='results file, default standard output')
+    args = parser.parse_args()
+
+    backend = FakeBackend(latency=args.latency_ms / 1e3)
+    # Named as in Pipeline.yml
+    os.environ.setdefault('RULES_TABLE', RULES_TABLE)
+    if args.verdict_cache:
+        os.environ['VERDICT_TABLE'] = VERDICT_TABLE
+    stub_boto3(backend.client)
+
+    report = {
+        'benchmark': 'replay_handlers',
+        'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': dict((key, value) for key, value in vars(args).items() if key != 'output'),
+        'handlers': dict()
+    }
+    null = open(os.devnull, 'w')
+    for name in args.handlers:
+        with contextlib.redirect_stdout(null):
+            module = importlib.import_module('SecGuardRails.' + name)
+            time_phases(module, PHASES[name])
+            handler = module.lambda_handler
+            events = HANDLERS[name](backend, args)
+        backend.timings.clear()
+        backend.jobs.clear()
+        with contextlib.redirect_stdout(null):
+            durations, phases, wall = replay(backend, handler, events, args.concurrency)
+
+        outcomes = {'success': 0, 'failure': 0, 'missing': 0}
+        for event in events:
+            result = backend.jobs.get(event['CodePipeline.job']['id'])
+            outcomes['missing' if result is None else 'success' if result == 'success' else 'failure'] += 1
+        result = {'invocations': len(events), 'wall_s': round(wall, 3),
+                  'invocations_per_s': round(len(events) / wall, 2), 'outcomes': outcomes}
+        result.update(latency_summary(durations))
+        result['phases'] = dict()
+        for phase in PHASES[name]:
+            timings = [spent[phase] for spent in phases if phase in spent]
+            if timings:
+                result['phases'][phase] = dict(
+                    invocations=len(timings), **latency_summary(timings))
+        result['operations'] = dict(
+            (operation, dict(calls_per_invocation=round(len(timings) / float(len(events)), 2),
+                             **latency_summary(timings)))
+            for operation, timings in sorted(backend.timings.items()))
+        report['handlers'][name] = result
+
+        print('{0}: {1} jobs in {2:.2f}s, {3:.1f}/s, p50 {4:.1f} ms, p99 {5:.1f} ms, {6}'.format(
+            name, len(events), wall, result['invocations_per_s'], result['p50_ms'], result['p99_ms'], outcomes),
+            file=sys.stderr)
+        for phase, timing in result['phases'].items():
+            print('  {0:<45} {1:>6d} jobs       p50 {2:>8.3f} ms  p99 {3:>8.3f} ms'.format(
+                phase, timing['invocations'], timing['p50_ms'], timing['p99_ms']), file=sys.stderr)
+        for operation, timing in result['operations'].items():
+            print('  {0:<45} {1:>6.2f} calls/job  p50 {2:>8.3f} ms  p99 {3:>8.3f} ms'.format(
+                operation, timing['calls_per_invocation'], timing['p50_ms'], timing['p99_ms']), file=sys.stderr)
+    null.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Benchmark of rule matching cost as the rulebook grows
+
+Matches a synthetic set of security group, instance and volume resources
+against rulebooks of 5 to 500 regex rules, with and without the literal
+prefilter of SecGuardRails.rule_engine, and prints the time per resource.
+
+Run from the code directory:
+
+    python benchmarks/rule_scaling.py
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from SecGuardRails import rule_engine
+from synthetic import make_resources, make_rules
+
+
+def run(ruleset, resources):
+    matched = 0
+    for resource in resources:
+        matched += len(ruleset.match(resource))
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resources', type=int, default=300, help='resources per run')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions')
+    parser.add_argument('--rules', type=int, nargs='+', default=[5, 50, 500])
+    args = parser.parse_args()
+
+    resources = make_resources(args.resources, kinds=('SecurityGroup', 'Instance', 'Volume'))
+    print('{0:>6} {1:>16} {2:>16} {3:>8}'.format('rules', 'regex us/res', 'prefilter us/res', 'speedup'))
+    for count in args.rules:
+        items = make_rules(count)
+        timings = []
+        for prefilter in (False, True):
+            ruleset = rule_engine.RuleSet(items, prefilter=prefilter)
+            best = min(timeit.repeat(lambda: run(ruleset, resources), number=1, repeat=args.repeat))
+            timings.append(best * 1e6 / len(resources))
+        print('{0:>6} {1:>16.1f} {2:>16.1f} {3:>7.1f}x'.format(count, timings[0], timings[1], timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
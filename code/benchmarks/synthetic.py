@@ -0,0 +1,154 @@
+"""Synthetic rulebooks and CloudFormation templates for the benchmarks
+
+Rules follow the format of the items of the rules table and resources the
+shape of the workshop templates, so the benchmarks exercise the same code
+paths as real pipeline runs.
+"""
+
+from __future__ import print_function
+import hashlib
+import random
+
+# Rule templates modelled on the rules shipped in cfn_validate_lambda.DEFAULT_RULES.
+# {0} is replaced with a value unique to each generated rule.
+RULE_TEMPLATES = [
+    ('SecurityGroup', r"^.*Ingress.*[fF]rom[pP]ort.\s*:\s*u?.({0})"),
+    ('SecurityGroup', r"^.*Ingress.*[cC]idr[iI]p.\s*:\s*u?.(10\.{0}\.0\.0\/16)"),
+    ('SecurityGroup', r"^.*Tag{0}.*Value.\s*:\s*u?.Public"),
+    ('EC2Instance', r"^.*ImageId.\s*:\s*u?.(ami-{0:08x})"),
+    ('EC2Instance', r"^.*InstanceType.\s*:\s*u?.(x{0}\.large)"),
+    ('Volume', r"^.*KmsKeyId.\s*:\s*u?.(alias/key{0})"),
+    ('Volume', r"^.*Encrypted.?\s*:\s*u?.?false"),
+    ('S3::Bucket', r"^.*BucketName.\s*:\s*u?.(bucket-{0})"),
+]
+
+# Resource kinds generated by make_resource
+KINDS = ('SecurityGroup', 'Instance', 'Volume', 'Bucket')
+
+
+def make_rules(count):
+    """Generates rule items in the DynamoDB format
+
+    Args:
+        count: The number of rules
+
+    Returns:
+        The list of rule items
+
+    """
+    items = []
+    for n in range(count):
+        category, ruledata = RULE_TEMPLATES[n % len(RULE_TEMPLATES)]
+        items.append({
+            'rule': {'S': 'Rule' + str(n)},
+            'category': {'S': category},
+            'ruletype': {'S': 'regex'},
+            'ruledata': {'S': ruledata.format(n)},
+            'riskvalue': {'N': '10'},
+            'active': {'S': 'Y'}
+        })
+    return items
+
+
+def make_settings(depth, n):
+    """Builds nested settings, depth levels deep"""
+    settings = {'Name': 'setting-' + str(n), 'Enabled': 'true'}
+    for level in range(depth):
+        settings = {'Level' + str(level): settings, 'Items': [str(level), str(n)], 'Mode': 'default'}
+    return settings
+
+
+def make_resource(kind, n, rnd, depth=0):
+    """Generates one resource shaped like the workshop template
+
+    Args:
+        kind: One of KINDS
+        n: The index of the resource
+        rnd: The random.Random generator
+        depth: Levels of nested settings added to the properties
+
+    Returns:
+        The resource
+
+    """
+    if kind == 'SecurityGroup':
+        resource = {'Type': 'AWS::EC2::SecurityGroup', 'Properties': {
+            'GroupDescription': 'Security group ' + str(n),
+            'SecurityGroupIngress': [
+                {'CidrIp': '10.{0}.0.0/16'.format(rnd.randint(0, 255)), 'FromPort': port,
+                 'ToPort': port, 'IpProtocol': 'tcp'} for port in (22, 443, 8080)],
+            'Tags': [{'Key': 'Name', 'Value': 'AWS'}, {'Key': 'LOB', 'Value': 'DevSecOps'}]}}
+    elif kind == 'Instance':
+        resource = {'Type': 'AWS::EC2::Instance', 'Properties': {
+            'ImageId': 'ami-{0:08x}'.format(rnd.randint(0, 1 << 32)),
+            'InstanceType': 't3.micro',
+            'Tags': [{'Key': 'Name', 'Value': 'AWS'}]}}
+    elif kind == 'Volume':
+        resource = {'Type': 'AWS::EC2::Volume', 'Properties': {
+            'Size': '8', 'Encrypted': rnd.choice(['true', 'true', 'false']),
+            'AvailabilityZone': {'Fn::Select': ['0', {'Fn::GetAZs': ''}]}}}
+    elif kind == 'Bucket':
+        resource = {'Type': 'AWS::S3::Bucket', 'Properties': {
+            'BucketName': 'bucket-' + str(n),
+            'VersioningConfiguration': {'Status': rnd.choice(['Enabled', 'Suspended'])}}}
+    else:
+        raise ValueError('Unknown resource kind ' + kind)
+    if depth:
+        resource['Properties']['Settings'] = make_settings(depth, n)
+    return resource
+
+
+def make_resources(count, seed=0, kinds=KINDS, weights=None, depth=0):
+    """Generates resources shaped like the workshop template
+
+    Args:
+        count: The number of resources
+        seed: The random seed
+        kinds: The resource kinds to generate
+        weights: The relative weight of each kind, None to cycle through them
+        depth: Levels of nested settings added to the properties
+
+    Returns:
+        The list of resources
+
+    """
+    rnd = random.Random(seed)
+    resources = []
+    for n in range(count):
+        if weights is None:
+            kind = kinds[n % len(kinds)]
+        else:
+            kind = rnd.choices(kinds, weights)[0]
+        resources.append(make_resource(kind, n, rnd, depth))
+    return resources
+
+
+def make_template(count, seed=0, kinds=KINDS, weights=None, depth=0):
+    """Generates a template with parameters, resources and outputs
+
+    Parameters hold digests that look like secret keys, so the secret
+    detectors have candidates to score.
+
+    Args:
+        count: The number of resources
+        seed: The random seed
+        kinds: The resource kinds to generate
+        weights: The relative weight of each kind, None to cycle through them
+        depth: Levels of nested settings added to the properties
+
+    Returns:
+        The template as a dictionary
+
+    """
+    resources = make_resources(count, seed, kinds, weights, depth)
+    template = {
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Description': 'Synthetic template with {0} resources'.format(count),
+        'Parameters': dict(
+            ('Digest' + str(n), {'Type': 'String', 'Default': hashlib.sha1(str(n).encode('ascii')).hexdigest()})
+            for n in range(max(1, count // 10))),
+        'Resources': dict(('Resource' + str(n), resource) for n, resource in enumerate(resources)),
+        'Outputs': dict(
+            ('Output' + str(n), {'Value': {'Ref': 'Resource' + str(n)}}) for n in range(min(count, 10)))
+    }
+    return template
@@ -2,20 +2,25 @@ from __future__ import print_function
 from boto3.session import Session
 
 import json
-import urllib
 import boto3
 import zipfile
 import tempfile
 import botocore
 import traceback
-import re
-import zipfile
-import time
 
 print('Loading function')
 print ()
-cf = boto3.client('cloudformation')
-code_pipeline = boto3.client('codepipeline')
+
+code_pipeline = None
+
+
+def get_code_pipeline():
+    """Returns the CodePipeline client, created on first use"""
+    global code_pipeline
+    if code_pipeline is None:
+        code_pipeline = boto3.client('codepipeline')
+    return code_pipeline
+
 
 def find_artifact(artifacts, name):
     """Finds the artifact 'name' among the 'artifacts'
@@ -120,7 +125,7 @@ def put_job_success(job, message):
     """
     print('Putting job success')
     print(message)
-    code_pipeline.put_job_success_result(jobId=job)
+    get_code_pipeline().put_job_success_result(jobId=job)
 
 def put_job_failure(job, message):
     """Notify CodePipeline of a failed job
@@ -135,7 +140,7 @@ def put_job_failure(job, message):
     """
     print('Putting job failure')
     print(message)
-    code_pipeline.put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
+    get_code_pipeline().put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
 
 def continue_job_later(job, message):
     """Notify CodePipeline of a continuing job
@@ -159,7 +164,7 @@ def continue_job_later(job, message):
 
     print('Putting job continuation')
     print(message)
-    code_pipeline.put_job_success_result(jobId=job, continuationToken=continuation_token)
+    get_code_pipeline().put_job_success_result(jobId=job, continuationToken=continuation_token)
 
 def get_user_params(job_data):
     print(job_data)
@@ -227,6 +232,22 @@ def setup_s3_client(job_data):
     return session.client('s3', config=botocore.client.Config(signature_version='s3v4'))
 
 
+def index_resources(template):
+    """Indexes the resources of a template by type in a single pass
+
+    Args:
+        template: The parsed CloudFormation template
+
+    Returns:
+        A dictionary of resource type to a list of (logical ID, properties) tuples
+
+    """
+    index = dict()
+    for logicalId, resource in template['Resources'].items():
+        index.setdefault(resource['Type'], []).append((logicalId, resource.get('Properties', {})))
+    return index
+
+
 def evaluate_template(template, job_id):
     # Validate rules and increase risk value
     #print(template)
@@ -237,30 +258,23 @@ def evaluate_template(template, job_id):
 
     #print(template)
 
-    for r in template['Resources']:
-    #print(template['Resources'][r])
-    for s in template['Resources'][r]:
-        #print(s)
-        if template['Resources'][r][s] == template['Resources'][r]['Type']:
-            #print(template['Resources'][r]['Type'])
-            if template['Resources'][r]['Type'] == 'AWS::EC2::Volume':
-                #print(template['Resources'][r]['Properties'])
-                try:
-                    if template['Resources'][r]['Properties']['Encrypted'] == 'true':
-                        print('Found encrypted EBS volume')
-                    if template['Resources'][r]['Properties']['Encrypted'] == 'false':
-                        risk = risk + 100
-                        print("Risk value: " +str(risk))
-                        failedRules.append("Found unencrypted EBS volume.")
-                        print("killing job")
-                        put_job_failure(job_id, "EBS Encryption is set to false")
-                    print('EBS encryption flag is neither true or false.')
-                except:
-                    risk = risk + 100
-                    print("Risk value: " +str(risk))
-                    failedRules.append("EBS volume with no encryption configured.")
-                    print("killing job")
-                    put_job_failure(job_id, "EBS Encryption is set to false")
+    for logicalId, properties in index_resources(template).get('AWS::EC2::Volume', []):
+        try:
+            if properties['Encrypted'] == 'true':
+                print('Found encrypted EBS volume')
+            if properties['Encrypted'] == 'false':
+                risk = risk + 100
+                print("Risk value: " +str(risk))
+                failedRules.append("Found unencrypted EBS volume.")
+                print("killing job")
+                put_job_failure(job_id, "EBS Encryption is set to false")
+            print('EBS encryption flag is neither true or false.')
+        except:
+            risk = risk + 100
+            print("Risk value: " +str(risk))
+            failedRules.append("EBS volume with no encryption configured.")
+            print("killing job")
+            put_job_failure(job_id, "EBS Encryption is set to false")
     print("----------------")
 
     if risk > 10:
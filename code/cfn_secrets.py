@@ -1,21 +1,32 @@
 from __future__ import print_function
 from boto3.session import Session
 
+import collections
+import contextlib
+import io
 import json
-import urllib
+import math
+import os
 import boto3
 import zipfile
 import tempfile
 import botocore
 import traceback
 import re
-import zipfile
-import time
 
 print('Loading function')
 print ()
-cf = boto3.client('cloudformation')
-code_pipeline = boto3.client('codepipeline')
+
+code_pipeline = None
+
+
+def get_code_pipeline():
+    """Returns the CodePipeline client, created on first use"""
+    global code_pipeline
+    if code_pipeline is None:
+        code_pipeline = boto3.client('codepipeline')
+    return code_pipeline
+
 
 def find_artifact(artifacts, name):
     """Finds the artifact 'name' among the 'artifacts'
@@ -77,25 +88,24 @@ def get_user_params(job_data):
 
     return decoded_parameters
 
-def get_template(s3, artifact, file_in_zip):
-    """Gets the template artifact
+@contextlib.contextmanager
+def open_artifact(s3, artifact):
+    """Opens the artifact zip
 
-    Downloads the artifact from the S3 artifact store to a temporary file
-    then extracts the zip and returns the file containing the CloudFormation
-    template.
+    Downloads the artifact from the S3 artifact store to a temporary file,
+    which is deleted when the context exits, and opens it as a zip so the
+    template can be read as a stream.
 
     Args:
         artifact: The artifact to download
-        file_in_zip: The path to the file within the zip containing the template
 
-    Returns:
-        The CloudFormation template as a string
+    Yields:
+        The zipfile.ZipFile of the artifact
 
     Raises:
         Exception: Any exception thrown while downloading the artifact or unzipping it
 
     """
-    tmp_file = tempfile.NamedTemporaryFile()
     bucket = artifact['location']['s3Location']['bucketName']
     key = artifact['location']['s3Location']['objectKey']
 
@@ -104,7 +114,7 @@ def get_template(s3, artifact, file_in_zip):
         s3.download_file(bucket, key, tmp_file.name)
         with zipfile.ZipFile(tmp_file.name, 'r') as zip:
             zip.printdir()
-            return zip.read(file_in_zip)
+            yield zip
 
 
 def put_job_success(job, message):
@@ -120,7 +130,7 @@ def put_job_success(job, message):
     """
     print('Putting job success')
     print(message)
-    code_pipeline.put_job_success_result(jobId=job)
+    get_code_pipeline().put_job_success_result(jobId=job)
 
 def put_job_failure(job, message):
     """Notify CodePipeline of a failed job
@@ -135,7 +145,7 @@ def put_job_failure(job, message):
     """
     print('Putting job failure')
     print(message)
-    code_pipeline.put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
+    get_code_pipeline().put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
 
 def continue_job_later(job, message):
     """Notify CodePipeline of a continuing job
@@ -159,7 +169,7 @@ def continue_job_later(job, message):
 
     print('Putting job continuation')
     print(message)
-    code_pipeline.put_job_success_result(jobId=job, continuationToken=continuation_token)
+    get_code_pipeline().put_job_success_result(jobId=job, continuationToken=continuation_token)
 
 def get_user_params(job_data):
     print(job_data)
@@ -227,44 +237,218 @@ def setup_s3_client(job_data):
     return session.client('s3', config=botocore.client.Config(signature_version='s3v4'))
 
 
+# Secret detectors as (finding, regex, scored) tuples, each run over the raw
+# template bytes. Add a tuple to detect another kind of secret. A match may
+# not be longer than MAX_MATCH bytes. Matches of scored detectors are only
+# reported when they look random, see is_random.
+SECRET_DETECTORS = [
+    ("AWS Key Found", rb'(?:A3T[A-Z0-9]|AKIA|AGPA|AIDA|AROA|AIPA|ANPA|ANVA|ASIA)[A-Z0-9]{16}', False),
+    ("Private Key Found", rb'-----BEGIN (?:RSA |DSA |EC |OPENSSH |PGP |ENCRYPTED )?PRIVATE KEY(?: BLOCK)?-----', False),
+    ("GitHub Token Found", rb'(?<![A-Za-z0-9_])gh[pousr]_[A-Za-z0-9]{36}(?![A-Za-z0-9_])', False),
+    ("Slack Token Found", rb'xox[abposr]-[A-Za-z0-9-]{10,200}', False),
+    ("AWS Secret Key Found", rb'(?<![A-Za-z0-9/+=])[A-Za-z0-9/+=]{40}(?![A-Za-z0-9/+=])', True),
+]
+MAX_MATCH = 256
+CHUNK_SIZE = 1024 * 1024
+
+# Minimum Shannon entropy, in bits per character, of a scored match. 40 hex
+# digits, such as a SHA-1 or a commit ID, stay below 4 bits while a random
+# base64 secret key is above 4.2 bits.
+ENTROPY_THRESHOLD = float(os.environ.get('SECRET_ENTROPY_THRESHOLD', '4.0'))
+
+# Minimum number of character classes (upper case, lower case, digits, others)
+# in a scored match
+MIN_CHAR_CLASSES = int(os.environ.get('SECRET_MIN_CHAR_CLASSES', '3'))
+
+# Whitespace separated regexes of values that are never reported, e.g. the
+# example keys of the AWS documentation
+ALLOW_LIST = os.environ.get('SECRET_ALLOW_LIST', '').split()
+
+# c * log2(c) for every character count c of a match, the terms of the entropy
+ENTROPY_TERMS = [0.0] + [c * math.log(c, 2) for c in range(1, MAX_MATCH + 1)]
+
+# Character class of every byte value, as a translate table
+CHAR_CLASSES = bytes(bytearray(
+    1 if 65 <= b <= 90 else 2 if 97 <= b <= 122 else 3 if 48 <= b <= 57 else 4 for b in range(256)))
+
+
+def compile_detectors(detectors):
+    """Compiles the regex of each detector
+
+    The regexes are run one by one rather than as a single alternation,
+    which is about twice as slow, as the alternation must try every
+    detector at every position.
+    """
+    return [re.compile(detector[1]) for detector in detectors]
+
+
+def compile_allow_list(allowList):
+    """Combines the allow list regexes into one regex, or None if empty"""
+    if not allowList:
+        return None
+    return re.compile(b'|'.join(b'(?:' + regex.encode('utf-8') + b')' for regex in allowList))
+
+
+SECRET_PATTERNS = compile_detectors(SECRET_DETECTORS)
+ALLOW_PATTERN = compile_allow_list(ALLOW_LIST)
+
+
+def entropy(token):
+    """Returns the Shannon entropy of a byte string in bits per character"""
+    length = len(token)
+    terms = sum(ENTROPY_TERMS[count] for count in collections.Counter(token).values())
+    return (ENTROPY_TERMS[length] - terms) / length
+
+
+def is_random(token, threshold=ENTROPY_THRESHOLD, minClasses=MIN_CHAR_CLASSES):
+    """Tells whether a candidate secret looks randomly generated
+
+    Args:
+        token: The candidate as bytes, at most MAX_MATCH long
+        threshold: The minimum entropy in bits per character
+        minClasses: The minimum number of character classes
+
+    Returns:
+        True if the token has enough character classes and entropy
+
+    """
+    if len(set(token.translate(CHAR_CLASSES))) < minClasses:
+        return False
+    return entropy(token) >= threshold
+
+
+def scan_secrets(stream, detectors=SECRET_DETECTORS, patterns=SECRET_PATTERNS, chunk_size=CHUNK_SIZE,
+                 allow=ALLOW_PATTERN, threshold=ENTROPY_THRESHOLD):
+    """Finds every secret in a stream of bytes
+
+    The stream is read in chunks and each detector is run over every chunk.
+    The last MAX_MATCH bytes of each chunk are kept for the next one, so
+    secrets that span two chunks are found once, and the hits do not depend
+    on the chunk size. Matches on the allow list, and matches of scored
+    detectors that do not look random, are skipped.
+
+    Args:
+        stream: A binary file-like object
+        detectors: The detectors the patterns were compiled from
+        patterns: The regexes returned by compile_detectors
+        chunk_size: Bytes read at a time
+        allow: The regex returned by compile_allow_list, or None
+        threshold: The minimum entropy of the matches of scored detectors
+
+    Returns:
+        A list of hits in the order of the stream, each a dictionary with
+        the finding, the line and column where it starts, both counted from
+        1, and the masked secret
+
+    """
+    hits = []
+    pending = []                    # (offset, detector, token) not reported yet
+    buffer = b''
+    base = 0                        # Offset of buffer[0] in the stream
+    resume = [0] * len(patterns)    # Offset in the buffer each detector searches from
+    counted = 0                     # Offset in the buffer up to which newlines are counted
+    line = 1                        # Line at counted
+    lineStart = 0                   # Offset in the stream where that line starts
+
+    def count_lines(end):
+        # Advances the line count from counted to end
+        newlines = buffer.count(b'\n', counted, end)
+        if newlines:
+            return line + newlines, base + buffer.rindex(b'\n', counted, end) + 1
+        return line, lineStart
+
+    while True:
+        chunk = stream.read(chunk_size)
+        final = not chunk
+        buffer += chunk
+        # A match ending in the last MAX_MATCH bytes could still grow with the
+        # next chunk, so it is left for the next round. Searches that start
+        # before the limit see all the bytes they can depend on.
+        limit = len(buffer) if final else len(buffer) - MAX_MATCH
+        for n, pattern in enumerate(patterns):
+            position = resume[n]
+            deferred = False
+            for match in pattern.finditer(buffer, position):
+                if match.end() > limit:
+                    # Positions from the limit on were searched in a truncated
+                    # buffer, so they are searched again
+                    position = min(match.start(), max(position, limit))
+                    deferred = True
+                    break
+                position = match.end()
+                token = match.group()
+                if allow is not None and allow.fullmatch(token):
+                    continue
+                if detectors[n][2] and not is_random(token, threshold):
+                    continue
+                pending.append((base + match.start(), n, token))
+            # Nothing can start before the limit any more
+            resume[n] = position if deferred else max(position, limit)
+
+        # Hits before the earliest resume offset cannot be preceded by a later
+        # one, so their lines are counted and they are reported
+        ready = base + (len(buffer) if final else min(resume))
+        pending.sort()
+        split = 0
+        while split < len(pending) and pending[split][0] < ready:
+            split += 1
+        for offset, n, token in pending[:split]:
+            line, lineStart = count_lines(offset - base)
+            counted = offset - base
+            secret = token.decode('ascii', 'replace')
+            hits.append({
+                'finding': detectors[n][0],
+                'line': line,
+                'column': offset - lineStart + 1,
+                'secret': secret[:4] + '*' * (len(secret) - 4)
+            })
+        del pending[:split]
+        if final:
+            return hits
+
+        # Drop what was searched, keeping a few bytes for lookbehinds
+        keep = max(0, min(resume) - 16)
+        if keep > counted:
+            line, lineStart = count_lines(keep)
+            counted = keep
+        buffer = buffer[keep:]
+        base += keep
+        resume = [position - keep for position in resume]
+        counted -= keep
+
+
 def evaluate_template(template, job_id):
-    # Validate rules and increase risk value
-    #print(template)
+    """Scores the template by the secrets found in it
+
+    The raw template bytes are scanned as a stream, without parsing it, and
+    every secret found adds 100 to the risk value.
+
+    Args:
+        template: The CloudFormation template as bytes, or a binary
+            file-like object such as the member opened from the artifact zip
+        job_id: The CodePipeline job ID
+
+    Returns:
+        A tuple of the risk value and the findings with their position
+
+    """
     risk = 0
     failedRules = []
     print("----------------")
-    
-    template = str(json.loads(template))
-
-    smite = re.compile(r'A3T[A-Z0-9]|(AKIA|AGPA|AIDA|AROA|AIPA|ANPA|ANVA|ASIA)[A-Z0-9]{16}')
-    matchobj = smite.search(template)
-    if matchobj:         # True if matchobj is not "nothing"
-        print(matchobj.group())
+    if isinstance(template, str):
+        template = template.encode('utf-8')
+    if isinstance(template, bytes):
+        template = io.BytesIO(template)
+    for hit in scan_secrets(template):
+        finding = "{0} at line {1}, column {2}".format(hit['finding'], hit['line'], hit['column'])
+        print(finding + ": " + hit['secret'])
         risk = risk + 100
-        print("Risk value: " +str(risk))
-        failedRules.append("AWS Key Found")
-        print("killing job")
-        put_job_failure(job_id, "AWS Key Found")
-    else:
-        print("No match!!")
-
-    smite2 = re.compile(r'(^|[^A-Za-z0-9/+=])[A-Za-z0-9/+=]{40}(?![A-Za-z0-9/+=])')
-    matchObj2 = smite2.search(template)
-    if matchObj2:
-        print(matchObj2.group())
-        risk = risk + 100
-        print("Risk value: " +str(risk))
-        failedRules.append("AWS Secret Key Found")
-        print("killing job")
-        put_job_failure(job_id, "AWS Secret Key Found")
-    else:
+        failedRules.append(finding)
+    if not failedRules:
         print("No match!!")
+    print("Risk value: " +str(risk))
     print("----------------")
 
-    if risk > 10:
-        print("good job")
-        put_job_success(job_id, 'Job succesful, minimal or no risk detected.')
-
     return risk, failedRules
 
 def s3_next_step(s3, bucket, risk, failedRules, template, job_id):
@@ -272,10 +456,11 @@ def s3_next_step(s3, bucket, risk, failedRules, template, job_id):
     s3Client = boto3.client('s3', config=botocore.client.Config(signature_version='s3v4'))
     tmp_file = tempfile.NamedTemporaryFile()
     tmp_zip = tempfile.NamedTemporaryFile()
-    
-    tmp_file.write(template)
-    
-    tmp_file.flush()
+
+    # High risk templates are not stored, so they are not read into memory
+    if risk < 50:
+        tmp_file.write(template)
+        tmp_file.flush()
     # Process file based on risk value
     if risk < 5:
         with zipfile.ZipFile(tmp_zip.name, 'w') as zip:
@@ -343,13 +528,14 @@ def lambda_handler(event, context):
         # Get S3 client to access artifact with
         s3 = setup_s3_client(job_data)
 
-        # Get the JSON template file out of the artifact
-        template = get_template(s3, input_artifact_data, template_file)
-        #print("Template: " + str(template))
-
+        with open_artifact(s3, input_artifact_data) as zip:
+            # Validate template from risk perspective, streaming it out of the
+            # artifact. FailedRules can be used if you wish to expand the script to report failed items
+            with zip.open(template_file) as stream:
+                risk, failedRules = evaluate_template(stream, job_id)
 
-        # Validate template from risk perspective. FailedRules can be used if you wish to expand the script to report failed items
-        risk, failedRules = evaluate_template(template, job_id)
+            # Only the templates stored by s3_next_step are read into memory
+            template = zip.read(template_file) if risk < 50 else None
 
         # Based on risk, store the template in the correct S3 bucket for future process
         s3_next_step(s3, output_bucket, risk, failedRules, template, job_id)
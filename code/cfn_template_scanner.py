@@ -0,0 +1,439 @@
+"""Scans a CloudFormation template with all the static checks at once
+
+Runs the checks of cfn_ftp_port.py, cfn_s3_versioning.py, cfn_encrypted_ebs.py
+and cfn_secrets.py in a single Lambda invocation. The artifact is downloaded
+and the template parsed once, then the resource checks registered for each
+resource type are applied to its resources, and the secret detectors run once
+over the raw template bytes, Parameters and Outputs included, as cfn_secrets.py
+does. The consolidated risk value routes the template like the other functions
+do.
+
+New resource checks are plain functions registered with the resource_check
+decorator.
+"""
+
+from __future__ import print_function
+from boto3.session import Session
+
+import collections
+import io
+import json
+import math
+import os
+import re
+import zipfile
+
+import boto3
+import botocore
+import traceback
+
+print('Loading function')
+
+code_pipeline = None
+
+
+def get_code_pipeline():
+    """Returns the CodePipeline client, created on first use"""
+    global code_pipeline
+    if code_pipeline is None:
+        code_pipeline = boto3.client('codepipeline')
+    return code_pipeline
+
+
+# Checks registered with the resource_check decorator, by resource type
+RESOURCE_CHECKS = {}
+
+
+def resource_check(resourceType):
+    """Registers a check run on every resource of a type
+
+    The check is called with the logical ID and the resource, and returns a
+    list of (finding, risk) tuples.
+
+    Args:
+        resourceType: The CloudFormation resource type, e.g. AWS::S3::Bucket
+
+    """
+    def register(function):
+        RESOURCE_CHECKS.setdefault(resourceType, []).append(function)
+        return function
+    return register
+
+
+@resource_check('AWS::EC2::SecurityGroup')
+def check_ftp_port(logicalId, resource):
+    # The check of cfn_ftp_port.py, which only looks at a SecurityGroupIngress
+    # given as a single rule; a list of rules is checked rule by rule here.
+    ingress = resource.get('Properties', {}).get('SecurityGroupIngress', [])
+    if isinstance(ingress, dict):
+        ingress = [ingress]
+    for rule in ingress:
+        if isinstance(rule, dict) and str(rule.get('FromPort')) == '21':
+            print('Found FTP port in ' + logicalId)
+            return [("Found FTP port.", 100)]
+    return []
+
+
+@resource_check('AWS::S3::Bucket')
+def check_s3_versioning(logicalId, resource):
+    # The check of cfn_s3_versioning.py, except that an Enabled bucket adds
+    # no risk; there it overwrites the total risk with 11, which discards the
+    # findings of the other buckets.
+    versioning = resource.get('Properties', {}).get('VersioningConfiguration')
+    if not isinstance(versioning, dict) or 'Status' not in versioning:
+        print('s3 bucket ' + logicalId + ' does not have VersionConfiguration configured.')
+        return [("s3 bucket does not have VersionConfiguration configured.", 100)]
+    if versioning['Status'] != 'Enabled':
+        print('Found s3 bucket ' + logicalId + ' with versioning ' + str(versioning['Status']))
+        return [("s3 versioning flag is neither Enabled or Suspended.", 100)]
+    return []
+
+
+@resource_check('AWS::EC2::Volume')
+def check_ebs_encryption(logicalId, resource):
+    # The check of cfn_encrypted_ebs.py, which only fails on the string
+    # 'false'; the boolean false of a YAML or JSON template fails here too.
+    properties = resource.get('Properties', {})
+    if 'Encrypted' not in properties:
+        print('EBS volume ' + logicalId + ' has no encryption configured.')
+        return [("EBS volume with no encryption configured.", 100)]
+    if str(properties['Encrypted']).lower() == 'false':
+        print('Found unencrypted EBS volume ' + logicalId)
+        return [("Found unencrypted EBS volume.", 100)]
+    return []
+
+
+# Same detectors as SECRET_DETECTORS in cfn_secrets.py, as (finding, regex,
+# scored) tuples. Each function is deployed on its own, so the detectors and
+# the scoring below are copied rather than imported; keep them in line.
+SECRET_DETECTORS = [
+    ("AWS Key Found", br'(?:A3T[A-Z0-9]|AKIA|AGPA|AIDA|AROA|AIPA|ANPA|ANVA|ASIA)[A-Z0-9]{16}', False),
+    ("Private Key Found", br'-----BEGIN (?:RSA |DSA |EC |OPENSSH |PGP |ENCRYPTED )?PRIVATE KEY(?: BLOCK)?-----', False),
+    ("GitHub Token Found", br'(?<![A-Za-z0-9_])gh[pousr]_[A-Za-z0-9]{36}(?![A-Za-z0-9_])', False),
+    ("Slack Token Found", br'xox[abposr]-[A-Za-z0-9-]{10,200}', False),
+    ("AWS Secret Key Found", br'(?<![A-Za-z0-9/+=])[A-Za-z0-9/+=]{40}(?![A-Za-z0-9/+=])', True),
+]
+SECRET_PATTERNS = [(finding, re.compile(regex), scored) for finding, regex, scored in SECRET_DETECTORS]
+
+# Scoring of the matches of scored detectors
+ENTROPY_THRESHOLD = float(os.environ.get('SECRET_ENTROPY_THRESHOLD', '4.0'))
+MIN_CHAR_CLASSES = int(os.environ.get('SECRET_MIN_CHAR_CLASSES', '3'))
+ALLOW_LIST = os.environ.get('SECRET_ALLOW_LIST', '').split()
+ALLOW_PATTERN = re.compile(
+    '|'.join('(?:' + regex + ')' for regex in ALLOW_LIST).encode('utf-8')) if ALLOW_LIST else None
+ENTROPY_TERMS = [0.0] + [c * math.log(c, 2) for c in range(1, 41)]
+# Character class of every byte value (upper case, lower case, digits, others),
+# as a translate table
+CHAR_CLASSES = bytes(bytearray(
+    1 if 65 <= b <= 90 else 2 if 97 <= b <= 122 else 3 if 48 <= b <= 57 else 4 for b in range(256)))
+
+
+def is_random(token):
+    """Tells whether a scored match, as bytes, has enough character classes and entropy"""
+    if len(set(token.translate(CHAR_CLASSES))) < MIN_CHAR_CLASSES:
+        return False
+    terms = sum(ENTROPY_TERMS[count] for count in collections.Counter(token).values())
+    return (ENTROPY_TERMS[len(token)] - terms) / len(token) >= ENTROPY_THRESHOLD
+
+
+def is_allowed(token):
+    return ALLOW_PATTERN is not None and ALLOW_PATTERN.fullmatch(token) is not None
+
+
+def scan_secrets(data):
+    """Runs the secret detectors once over the raw template bytes
+
+    Every finding is reported once, so each detector stops at its first hit.
+
+    Args:
+        data: The CloudFormation template as bytes
+
+    Returns:
+        A list of (finding, risk) tuples
+
+    """
+    findings = []
+    for finding, pattern, scored in SECRET_PATTERNS:
+        for match in pattern.finditer(data):
+            token = match.group()
+            if not is_allowed(token) and (not scored or is_random(token)):
+                findings.append((finding, 100))
+                break
+    return findings
+
+
+def scan_template(template):
+    """Runs the registered resource checks over the resources of the template
+
+    Args:
+        template: The parsed CloudFormation template
+
+    Returns:
+        A list of the (finding, risk) tuples of all checks
+
+    """
+    findings = []
+    resources = template.get('Resources', {}) if isinstance(template, dict) else {}
+    for logicalId, resource in resources.items():
+        if isinstance(resource, dict):
+            for check in RESOURCE_CHECKS.get(resource.get('Type'), []):
+                findings.extend(check(logicalId, resource))
+    return findings
+
+
+def evaluate_template(template):
+    """Scores the template with all checks
+
+    Each finding is reported once, the first time it is seen, as the single
+    purpose functions do.
+
+    Args:
+        template: The CloudFormation template as bytes or a string
+
+    Returns:
+        A tuple of the total risk value and the list of findings
+
+    """
+    if not isinstance(template, bytes):
+        template = template.encode('utf-8')
+    risk = 0
+    failedRules = []
+    print("----------------")
+    for finding, findingRisk in scan_template(json.loads(template)) + scan_secrets(template):
+        if finding in failedRules:
+            continue
+        risk = risk + findingRisk
+        failedRules.append(finding)
+        print(finding)
+        print("Risk value: " + str(risk))
+    print("----------------")
+    return risk, failedRules
+
+
+def find_artifact(artifacts, name):
+    """Finds the artifact 'name' among the 'artifacts'
+
+    Args:
+        artifacts: The list of artifacts available to the function
+        name: The artifact we wish to use
+    Returns:
+        The artifact dictionary found
+    Raises:
+        Exception: If no matching artifact is found
+
+    """
+    for artifact in artifacts:
+        if artifact['name'] == name:
+            return artifact
+
+    raise Exception('Input artifact named "{0}" not found in event'.format(name))
+
+
+def get_user_params(job_data):
+    """Decodes the JSON user parameters and validates the required properties.
+
+    Args:
+        job_data: The job data structure containing the UserParameters string which should be a valid JSON structure
+
+    Returns:
+        The JSON parameters decoded as a dictionary.
+
+    Raises:
+        Exception: The JSON can't be decoded or a property is missing.
+
+    """
+    try:
+        # Get the user parameters which contain the artifact and file settings
+        user_parameters = job_data['actionConfiguration']['configuration']['UserParameters']
+        decoded_parameters = json.loads(user_parameters)
+
+    except Exception as e:
+        # We're expecting the user parameters to be encoded as JSON
+        # so we can pass multiple values. If the JSON can't be decoded
+        # then fail the job with a helpful message.
+        raise Exception('UserParameters could not be decoded as JSON')
+
+    if 'input' not in decoded_parameters:
+        # Validate that the artifact name is provided, otherwise fail the job
+        # with a helpful message.
+        raise Exception('Your UserParameters JSON must include the artifact name')
+
+    if 'file' not in decoded_parameters:
+        # Validate that the template file is provided, otherwise fail the job
+        # with a helpful message.
+        raise Exception('Your UserParameters JSON must include the template file name')
+
+    if 'output' not in decoded_parameters:
+        # Validate that the template file is provided, otherwise fail the job
+        # with a helpful message.
+        raise Exception('Your UserParameters JSON must include the output bucket')
+
+    return decoded_parameters
+
+
+def get_template(s3, artifact, file_in_zip):
+    """Gets the template artifact
+
+    Reads the artifact zip from the S3 artifact store into memory and returns
+    the file containing the CloudFormation template.
+
+    Args:
+        artifact: The artifact to download
+        file_in_zip: The path to the file within the zip containing the template
+
+    Returns:
+        The CloudFormation template as a string
+
+    Raises:
+        Exception: Any exception thrown while downloading the artifact or unzipping it
+
+    """
+    bucket = artifact['location']['s3Location']['bucketName']
+    key = artifact['location']['s3Location']['objectKey']
+
+    print("Retrieving s3://" + bucket + "/" + key)
+    body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    with zipfile.ZipFile(io.BytesIO(body), 'r') as zip:
+        return zip.read(file_in_zip)
+
+
+def put_job_success(job, message):
+    """Notify CodePipeline of a successful job
+
+    Args:
+        job: The CodePipeline job ID
+        message: A message to be logged relating to the job status
+
+    Raises:
+        Exception: Any exception thrown by .put_job_success_result()
+
+    """
+    print('Putting job success')
+    print(message)
+    get_code_pipeline().put_job_success_result(jobId=job)
+
+
+def put_job_failure(job, message):
+    """Notify CodePipeline of a failed job
+
+    Args:
+        job: The CodePipeline job ID
+        message: A message to be logged relating to the job status
+
+    Raises:
+        Exception: Any exception thrown by .put_job_failure_result()
+
+    """
+    print('Putting job failure')
+    print(message)
+    get_code_pipeline().put_job_failure_result(jobId=job, failureDetails={'message': message, 'type': 'JobFailed'})
+
+
+def setup_s3_client(job_data):
+    """Creates an S3 client
+
+    Uses the credentials passed in the event by CodePipeline. These
+    credentials can be used to access the artifact bucket.
+
+    Args:
+        job_data: The job data structure
+
+    Returns:
+        An S3 client with the appropriate credentials
+
+    """
+    key_id = job_data['artifactCredentials']['accessKeyId']
+    key_secret = job_data['artifactCredentials']['secretAccessKey']
+    session_token = job_data['artifactCredentials']['sessionToken']
+
+    session = Session(
+        aws_access_key_id=key_id,
+        aws_secret_access_key=key_secret,
+        aws_session_token=session_token)
+    return session.client('s3', config=botocore.client.Config(signature_version='s3v4'))
+
+
+def s3_next_step(s3, bucket, risk, failedRules, template, job_id):
+    """Routes the template based on its risk value
+
+    Low and medium risk templates are zipped in memory and stored in the
+    output bucket as valid.template.zip or flagged.template.zip, high risk
+    templates fail the job.
+
+    """
+    if risk < 5:
+        name = 'valid.template'
+        message = 'Job succesful, minimal or no risk detected.'
+    elif risk < 50:
+        name = 'flagged.template'
+        message = 'Job succesful, medium risk detected, manual approval needed.'
+    else:
+        print("High risk file, fail pipeline")
+        put_job_failure(job_id, 'Function exception: Failed filters ' + str(failedRules))
+        return 0
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip:
+        zip.writestr(name + '.json', template)
+    s3Client = boto3.client('s3', config=botocore.client.Config(signature_version='s3v4'))
+    s3Client.put_object(Bucket=bucket, Key=name + '.zip', Body=buffer.getvalue(), ServerSideEncryption='AES256')
+    put_job_success(job_id, message)
+    return 0
+
+
+def lambda_handler(event, context):
+    """The Lambda function handler
+
+    Validate input template for security vulnerables.  Route as appropriate based on risk assesment.
+
+    Args:
+        event: The event passed by Lambda
+        context: The context passed by Lambda
+
+    """
+    try:
+        # Print the entire event for tracking
+        print("Received event: " + json.dumps(event, indent=2))
+
+        # Extract the Job ID
+        job_id = event['CodePipeline.job']['id']
+
+        # Extract the Job Data
+        job_data = event['CodePipeline.job']['data']
+
+        # Extract the params
+        params = get_user_params(job_data)
+
+        # Get the list of artifacts passed to the function
+        input_artifacts = job_data['inputArtifacts']
+
+        input_artifact = params['input']
+        template_file = params['file']
+        output_bucket = params['output']
+
+        # Get the artifact details
+        input_artifact_data = find_artifact(input_artifacts, input_artifact)
+
+        # Get S3 client to access artifact with
+        s3 = setup_s3_client(job_data)
+
+        # Get the JSON template file out of the artifact
+        template = get_template(s3, input_artifact_data, template_file)
+        print("Template: " + template_file)
+
+        # Run all checks over the template in one pass
+        risk, failedRules = evaluate_template(template)
+
+        # Based on risk, store the template in the correct S3 bucket for future process
+        s3_next_step(s3, output_bucket, risk, failedRules, template, job_id)
+
+    except Exception as e:
+        # If any other exceptions which we didn't expect are raised
+        # then fail the job and log the exception message.
+        print('Function failed due to exception.')
+        print(e)
+        traceback.print_exc()
+        put_job_failure(job_id, 'Function exception: ' + str(e))
+
+    print('Function complete.')
+    return "Complete."
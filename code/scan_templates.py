@@ -0,0 +1,284 @@
+"""Scans CloudFormation templates on disk with the pipeline checks
+
+Runs the checks of the pipeline's Lambda functions over a directory tree or
+glob of templates, without CodePipeline:
+
+- the rules of the rules table, as SecGuardRails/cfn_validate_lambda.py
+  applies them, from a JSON export of the table or the default rulebook;
+- the resource checks of cfn_template_scanner.py;
+- the secret detectors of cfn_secrets.py.
+
+Templates are scanned across a pool of processes and the findings written as
+a JSON or SARIF report. The exit code is 1 when a template reaches the risk
+value that fails the pipeline or cannot be read.
+
+Run from the code directory:
+
+    python scan_templates.py codepipe-AWS-devsecops/
+    python scan_templates.py 'templates/**/*.json' --format sarif -o report.sarif
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Keep what the Lambda modules print when loaded out of the report
+with contextlib.redirect_stdout(sys.stderr):
+    import cfn_secrets
+    import cfn_template_scanner
+    from SecGuardRails import cfn_validate_lambda
+    from SecGuardRails import rule_engine
+
+# File extensions scanned when a directory is given
+TEMPLATE_EXTENSIONS = ('.json', '.template')
+
+# Risk values routing a template, as in s3_next_step
+FLAGGED_RISK = 5
+FAILED_RISK = 50
+
+# Templates sent to a worker at a time
+CHUNK_SIZE = 16
+
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+
+# Per process state set by init_worker
+worker = {'rules': None, 'null': None}
+
+
+def find_templates(patterns):
+    """Expands directories and globs into the sorted list of template paths
+
+    Args:
+        patterns: Directories, files or glob patterns, ** matching any depth
+
+    Returns:
+        The list of paths, each listed once
+
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                for name in files:
+                    if name.endswith(TEMPLATE_EXTENSIONS):
+                        paths.add(os.path.join(root, name))
+        else:
+            paths.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(paths)
+
+
+def load_rule_items(path):
+    """Reads rule items from a file, or returns the default rulebook
+
+    Args:
+        path: A JSON file holding a list of DynamoDB items, or the output of
+            "aws dynamodb scan", or None
+
+    Returns:
+        The list of rule items
+
+    """
+    if path is None:
+        return cfn_validate_lambda.DEFAULT_RULES
+    with open(path) as f:
+        items = json.load(f)
+    if isinstance(items, dict):
+        items = items['Items']
+    return [item for item in items if item['rule']['S'] != cfn_validate_lambda.RULE_VERSION_KEY]
+
+
+def init_worker(items, budget):
+    worker['null'] = open(os.devnull, 'w')
+    with contextlib.redirect_stdout(worker['null']):
+        worker['rules'] = rule_engine.RuleSet(items, budget=budget)
+
+
+def verdict(risk):
+    if risk < FLAGGED_RISK:
+        return 'valid'
+    if risk < FAILED_RISK:
+        return 'flagged'
+    return 'failed'
+
+
+def scan_template(data, template):
+    """Runs all checks on a parsed template
+
+    The rules are scored with cfn_validate_lambda.score_template, as the
+    pipeline does. Files without a Resources section, such as the stack
+    configuration files, are only scanned for secrets.
+
+    Args:
+        data: The template as bytes
+        template: The parsed template
+
+    Returns:
+        The list of findings
+
+    """
+    findings = []
+    with contextlib.redirect_stdout(worker['null']):
+        if isinstance(template, dict) and 'Resources' in template:
+            rules = worker['rules']
+            reasons = dict((rule.name, reason) for rule, reason in rules.rejected)
+            for finding in cfn_validate_lambda.score_template(rules, template)[1]:
+                if finding.status == rule_engine.REJECTED:
+                    findings.append({'check': finding.rule, 'source': 'rules', 'risk': finding.risk,
+                                     'message': 'Rule rejected: ' + reasons[finding.rule]})
+                elif finding.status == rule_engine.TIMED_OUT:
+                    findings.append({'check': finding.rule, 'source': 'rules', 'risk': finding.risk,
+                                     'message': 'Rule ran out of its time budget', 'resource': finding.resource})
+                else:
+                    findings.append({'check': finding.rule, 'source': 'rules', 'risk': finding.risk,
+                                     'message': 'Matched rule ' + finding.rule, 'resource': finding.resource,
+                                     'span': finding.span})
+            for logicalId, resource in template['Resources'].items():
+                for check in cfn_template_scanner.RESOURCE_CHECKS.get(resource['Type'], []):
+                    for finding, risk in check(logicalId, resource):
+                        findings.append({'check': check.__name__, 'source': 'checks', 'risk': risk,
+                                         'message': finding, 'resource': logicalId})
+        for hit in cfn_secrets.scan_secrets(io.BytesIO(data)):
+            findings.append({'check': hit['finding'], 'source': 'secrets', 'risk': 100,
+                             'message': hit['finding'] + ': ' + hit['secret'],
+                             'line': hit['line'], 'column': hit['column']})
+    return findings
+
+
+def scan_file(path):
+    """Scans one template with all checks
+
+    Args:
+        path: The path of the template
+
+    Returns:
+        A dictionary with the path, risk value, verdict and findings of the
+        template, or the path and error if it could not be scanned
+
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        template = json.loads(data)
+    except (IOError, ValueError) as e:
+        return {'path': path, 'error': str(e)}
+
+    try:
+        findings = scan_template(data, template)
+    except Exception as e:
+        # A template of the wrong shape must not stop the scan of the others
+        return {'path': path, 'error': '{0}: {1}'.format(type(e).__name__, e)}
+
+    risk = sum(finding['risk'] for finding in findings)
+    return {'path': path, 'risk': risk, 'verdict': verdict(risk), 'findings': findings}
+
+
+def scan_templates(paths, items, workers=None, budget=1.0):
+    """Scans templates across a pool of processes
+
+    Args:
+        paths: The paths of the templates
+        items: The rule items
+        workers: The number of processes, None for one per CPU, 1 to scan in
+            this process
+        budget: Seconds a regex rule may spend on a template
+
+    Returns:
+        The list of scan_file results, in the order of the paths
+
+    """
+    if workers == 1:
+        init_worker(items, budget)
+        return [scan_file(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(items, budget)) as pool:
+        return list(pool.map(scan_file, paths, chunksize=CHUNK_SIZE))
+
+
+def json_report(results):
+    summary = {'templates': len(results), 'errors': 0, 'valid': 0, 'flagged': 0, 'failed': 0}
+    for result in results:
+        summary[result.get('verdict', 'errors')] += 1
+    return {'summary': summary, 'templates': results}
+
+
+def sarif_report(results):
+    """Converts the scan results into a SARIF 2.1.0 log
+
+    Findings are warnings, or errors when their risk value alone fails the
+    pipeline. Templates that could not be scanned are reported as tool
+    execution notifications.
+
+    """
+    checks = dict()
+    sarifResults = []
+    notifications = []
+    for result in results:
+        if 'error' in result:
+            notifications.append({'level': 'error', 'message': {'text': result['error']},
+                                  'locations': [{'physicalLocation': {'artifactLocation': {'uri': result['path']}}}]})
+            continue
+        for finding in result['findings']:
+            checks.setdefault(finding['check'], finding['source'])
+            location = {'physicalLocation': {'artifactLocation': {'uri': result['path']}}}
+            if 'line' in finding:
+                location['physicalLocation']['region'] = {'startLine': finding['line'],
+                                                          'startColumn': finding['column']}
+            if 'resource' in finding:
+                location['logicalLocations'] = [{'name': finding['resource'], 'kind': 'resource'}]
+            sarifResults.append({
+                'ruleId': finding['check'],
+                'level': 'error' if finding['risk'] >= FAILED_RISK else 'warning' if finding['risk'] else 'note',
+                'message': {'text': finding['message']},
+                'locations': [location],
+                'properties': {'risk': finding['risk'], 'source': finding['source']}
+            })
+    return {
+        '$schema': SARIF_SCHEMA,
+        'version': '2.1.0',
+        'runs': [{
+            'tool': {'driver': {
+                'name': 'secure-pipelines-scan-templates',
+                'rules': [{'id': check, 'properties': {'source': source}} for check, source in sorted(checks.items())]
+            }},
+            'invocations': [{'executionSuccessful': not notifications,
+                             'toolExecutionNotifications': notifications}],
+            'results': sarifResults
+        }]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='template files, directories or glob patterns')
+    parser.add_argument('--rules', help='JSON export of the rules table, default the seeded rulebook')
+    parser.add_argument('--format', choices=('json', 'sarif'), default='json')
+    parser.add_argument('-o', '--output', help='report file, default standard output')
+    parser.add_argument('-w', '--workers', type=int, help='processes, default one per CPU')
+    parser.add_argument('--budget', type=float, default=cfn_validate_lambda.RULE_TIME_BUDGET,
+                        help='seconds a regex rule may spend on a template, 0 for no limit')
+    args = parser.parse_args()
+
+    paths = find_templates(args.paths)
+    if not paths:
+        parser.error('no template found')
+    results = scan_templates(paths, load_rule_items(args.rules), args.workers, args.budget)
+    report = sarif_report(results) if args.format == 'sarif' else json_report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    failed = [result for result in results if 'error' in result or result['verdict'] == 'failed']
+    print('Scanned {0} templates, {1} failed'.format(len(results), len(failed)), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())